@@ -1,18 +1,10 @@
+from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Tuple
 from typing import Union
 
-Payload = Tuple[List['Literal'], 'Substitution']
-
-
-class Root:
-    def __init__(self):
-        self.children = set()
-
-    def notify(self, ground: 'Literal'):
-        for child in self.children:
-            child.notify(ground, {}, self)
+from arkham.other.tempo import Clause, Root, Scheduler, Token, is_variable
 
 
 class Alpha:
@@ -20,112 +12,136 @@ class Alpha:
         self.parent = parent
         self.pattern = pattern
         self.name = repr(pattern)
-        self.memory = []
+        self.variables = tuple(dict.fromkeys(t for t in pattern.terms if is_variable(t)))
+        self.memory = {}
         self.children = set()
-        parent.children.add(self)
+        parent.add_child(self)
+
+    def __len__(self) -> int:
+        return len(self.memory)
 
     def notify(self, ground: 'Literal', subs: 'Substitution', parent: Root):
-        subs = self.pattern.unifies(ground)
-        if subs is not None:
-            payload = ([ground], subs)
-            if payload not in self.memory:
-                self.memory.append(payload)
+        if ground not in self.memory:
+            subs = self.pattern.unifies(ground)
+            if subs is not None:
+                self.memory[ground] = subs
                 for child in self.children:
-                    child.notify([ground], subs, self)
+                    child.notify((ground,), subs, self)
 
 
 class Beta:
-    def __init__(self, parent_1: Union[Alpha, 'Beta'], parent_2: Alpha):
+    def __init__(self, parent_1: Union[Alpha, 'Beta'], parent_2: Alpha, renaming: Optional[Dict[str, str]] = None):
         self.parent_1 = parent_1
         self.parent_2 = parent_2
-        self.name = '%s, %s' % (parent_1.name, parent_2.name)
-        self.memory = []
+        self.renaming = renaming or {v: v for v in parent_2.variables}
+        self.name = '%s, %s' % (parent_1.name, parent_2.pattern.substitutes(self.renaming))
+        right = tuple(self.renaming[v] for v in parent_2.variables)
+        self.variables = tuple(dict.fromkeys((*parent_1.variables, *right)))
+        self.join = tuple(v for v in right if v in parent_1.variables)
+        self.left = {}
+        self.right = {}
+        self.memory = {}
         self.children = set()
         parent_1.children.add(self)
         parent_2.children.add(self)
 
-    def notify(self, ground: List['Literal'], subs: 'Substitution', parent: Union[Alpha, 'Beta']):
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def notify(self, token: Token, subs: 'Substitution', parent: Union[Alpha, 'Beta']):
         if parent is self.parent_1:
-            for ground_2, subs_2 in self.parent_2.memory:
-                self._notify(ground, subs, ground_2, subs_2)
-        elif parent is self.parent_2:
-            for ground_1, subs_1 in self.parent_1.memory:
-                self._notify(ground_1, subs_1, ground, subs)
-
-    @staticmethod
-    def _unifies(subs_1: 'Substitution', subs_2: 'Substitution') -> Optional['Substitution']:
-        for var in set(subs_1).intersection(subs_2):
-            if subs_1[var] != subs_2[var]:
-                return None
-
-        return {**subs_1, **subs_2}
-
-    def _notify(self, ground_1: List['Literal'], subs_1: 'Substitution', ground_2: List['Literal'],
-                subs_2: 'Substitution'):
-        subs = self._unifies(subs_1, subs_2)
-        if subs is not None:
-            ground = [*ground_1, *ground_2]
-            payload = (ground, subs)
-            if payload not in self.memory:
-                self.memory.append(payload)
-                for child in self.children:
-                    child.notify(ground, subs, self)
+            key = tuple(subs[v] for v in self.join)
+            self.left.setdefault(key, {})[token] = subs
+            for token_2, subs_2 in tuple(self.right.get(key, {}).items()):
+                self._notify(token, subs, token_2, subs_2)
+        if parent is self.parent_2:
+            subs = {self.renaming[v]: t for v, t in subs.items()}
+            key = tuple(subs[v] for v in self.join)
+            self.right.setdefault(key, {})[token] = subs
+            for token_1, subs_1 in tuple(self.left.get(key, {}).items()):
+                self._notify(token_1, subs_1, token, subs)
+
+    def _notify(self, token_1: Token, subs_1: 'Substitution', token_2: Token, subs_2: 'Substitution'):
+        token = (*token_1, *token_2)
+        if token not in self.memory:
+            subs = {**subs_1, **subs_2}
+            self.memory[token] = subs
+            for child in self.children:
+                child.notify(token, subs, self)
 
 
 class Leaf:
-    def __init__(self, rule: 'Rule', parent: Union[Alpha, Beta], root: Root, agenda: List):
+    def __init__(self, rule: 'Rule', parent: Union[Alpha, Beta], scheduler: Scheduler, agenda: Dict['Rule', None],
+                 renaming: Optional[Dict[str, str]] = None):
         self.parent = parent
         self.rule = rule
+        self.head = rule.head.substitutes(renaming) if renaming else rule.head
         self.name = repr(rule)
-        self.memory = []
+        self.memory = {}
 
-        self.root = root
+        self.scheduler = scheduler
         self.agenda = agenda
         parent.children.add(self)
 
-    def notify(self, ground: List['Literal'], subs: 'Substitution', parent: Union[Alpha, 'Beta']):
-        from arkham.other.tempo import Clause
+    def __len__(self) -> int:
+        return len(self.memory)
 
-        payload = (ground, subs)
-        if payload not in self.memory:
-            self.memory.append(payload)
+    def notify(self, token: Token, subs: 'Substitution', parent: Union[Alpha, 'Beta']):
+        if token not in self.memory:
+            self.memory[token] = subs
 
-            lit = self.rule.head.substitutes(subs)
+            lit = self.head.substitutes(subs)
             # if self.rule.type is RuleType.STRICT:
             #     fact = Rule(lit, self.rule.type, [])
             #     if fact not in self.agenda:
             #         self.agenda.append(fact)
 
-            rule = Clause(lit, ground)
-            if rule not in self.agenda:
-                self.agenda.append(rule)
+            self.agenda.setdefault(Clause(lit, token), None)
+
+            self.scheduler.push(lit)
+
+
+def _canonicalize(literals: List['Literal']) -> Tuple[Tuple['Literal', ...], Dict[str, str]]:
+    renaming = {}
+    for lit in literals:
+        for term in lit.terms:
+            if is_variable(term) and term not in renaming:
+                renaming[term] = '_%d' % len(renaming)
 
-            self.root.notify(lit)
+    return tuple(lit.substitutes(renaming) for lit in literals), renaming
 
 
 def fire_rules(program: 'Program') -> List['Rule']:
     if program.is_ground():
         return program
 
-    rules = []
+    rules = {}
     table = {}
     root = Root()
+    scheduler = Scheduler(root)
     for rule in program.rules:
         if rule.is_fact():
-            rules.append(rule)
+            rules.setdefault(rule, None)
         else:
+            body, renaming = _canonicalize(rule.body)
             beta = None
-            for lit in rule.body:
-                name = repr(lit)
-                alfa = table.setdefault(name, Alpha(lit, root))
+            for lit in body:
+                (pattern,), local = _canonicalize([lit])
+                name = repr(pattern)
+                alfa = table.get(name)
+                if alfa is None:
+                    alfa = table[name] = Alpha(pattern, root)
                 if beta is None:
                     beta = alfa
                 else:
-                    name = '%s, %s' % (beta.name, alfa.name)
-                    beta = table.setdefault(name, Beta(beta, alfa))
-            Leaf(rule, beta, root, rules)
+                    name = '%s, %s' % (beta.name, lit)
+                    shared = table.get(name)
+                    if shared is None:
+                        shared = table[name] = Beta(beta, alfa, {v: k for k, v in local.items()})
+                    beta = shared
+            Leaf(rule, beta, scheduler, rules, renaming)
 
-    for fact in program.get_facts():
-        root.notify(fact.head)
+    scheduler.extend(fact.head for fact in program.get_facts())
+    scheduler.run()
 
-    return rules
+    return list(rules)
@@ -1,17 +1,50 @@
 import re
-from math import inf, log
-from typing import Dict, List
+from ast import literal_eval
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from heapq import heapify, heappop, heappush, heappushpop, merge
+from io import StringIO
+from itertools import count, islice, repeat
+from math import inf, log, nan
+from random import Random
+from time import perf_counter
+from typing import Callable
+from typing import Dict, FrozenSet, List
 from typing import Iterable
+from typing import Iterator
 from typing import Optional
+from typing import Set
+from typing import TextIO
 from typing import Tuple
 from typing import Union
+from weakref import WeakValueDictionary
+
+try:
+    import numpy
+except ImportError:  # bitset rows are used instead
+    numpy = None
 
 Value = Union[bool, float, int, str]
 Variable = str
 Term = Union[Value, Variable]
 Substitution = Dict[Variable, Term]
+Signature = Tuple[bool, str, int]
 
 _var_pattern = re.compile(r'[_A-Z][_a-zA-Z0-9]*')
+_missing = object()
+_sign_pattern = re.compile(r'\s*\(([+-])\)')
+_space_pattern = re.compile(r'(?:\s+|%[^\n]*)*')
+_token_pattern = re.compile(r'''(?:\s+|%[^\n]*)*(?:
+    (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|-inf\b)
+    |(?P<name>[_a-zA-Z][_a-zA-Z0-9]*)
+    |(?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+    |(?P<symbol>:-|[(),.~])
+    |\Z
+)''', re.VERBOSE)
+_end = ('end', '')
+_keywords = {'True': True, 'False': False, 'inf': inf, 'nan': nan}
+_ground = None
 
 
 def is_variable(term: Term) -> bool:
@@ -22,39 +55,43 @@ def term_repr(term: Term) -> str:
     if any(isinstance(term, c) for c in [bool, float, int]):
         return str(term)
 
-    if isinstance(term, str) and re.match(r'[_a-zA-Z][_a-zA-Z0-9]*', term):
+    if isinstance(term, str) and term not in _keywords and re.fullmatch(r'[_a-zA-Z][_a-zA-Z0-9]*', term):
         return str(term)
 
     return repr(term)
 
 
 class Atom:
-    def __init__(self, functor: str, terms: Tuple[Term, ...] = ()):
-        self._functor = functor
-        self._terms = terms
+    # Atoms are hash-consed: each distinct atom is built once, so equality is identity and the hash is precomputed.
+    __slots__ = ('_functor', '_terms', '_hash', '_ground', '__weakref__')
 
-    def __hash__(self) -> int:
-        value = hash(self._functor)
-        for term in self._terms:
-            value = value ** hash(term)
+    _instances = WeakValueDictionary()
 
-        return value
+    def __new__(cls, functor: str, terms: Tuple[Term, ...] = ()):
+        terms = tuple(terms)
+        key = (functor, terms, tuple(map(type, terms)))
+        atom = cls._instances.get(key)
+        if atom is None:
+            atom = super().__new__(cls)
+            atom._functor = functor
+            atom._terms = terms
+            atom._hash = hash((functor, terms))
+            atom._ground = not any(is_variable(t) for t in terms)
+            cls._instances[key] = atom
 
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Atom):
-            return False
+        return atom
 
-        if term_repr(self._functor) != term_repr(other._functor):
-            return False
+    def __hash__(self) -> int:
+        return self._hash
 
-        if len(self._terms) != len(other._terms):
-            return False
+    def __reduce__(self):
+        return Atom, (self._functor, self._terms)
 
-        for i, term in enumerate(self._terms):
-            if term_repr(term) != term_repr(other._terms[i]):
-                return False
+    def __copy__(self) -> 'Atom':
+        return self
 
-        return True
+    def __deepcopy__(self, memo) -> 'Atom':
+        return self
 
     def __repr__(self) -> str:
         if self._terms:
@@ -74,18 +111,21 @@ class Atom:
         return len(self._terms)
 
     def is_ground(self) -> bool:
-        return all(not is_variable(t) for t in self._terms)
+        return self._ground
 
     def unify(self, other: 'Atom') -> Optional[Substitution]:
         if not isinstance(other, Atom):
             return None
 
-        if term_repr(self._functor) != term_repr(other._functor):
+        if self._functor != other._functor:
             return None
 
         if len(self._terms) != len(other._terms):
             return None
 
+        if self is other and self._ground:
+            return {}
+
         substitution = {}
         for i, term in enumerate(self._terms):
             if is_variable(term):
@@ -100,25 +140,40 @@ class Atom:
         return substitution
 
     def substitute(self, substitution: Substitution) -> 'Atom':
-        return Atom(self.functor, tuple(substitution.get(t, t) if is_variable(t) else t for t in self._terms))
+        if self._ground:
+            return self
+
+        return Atom(self._functor, tuple(substitution.get(t, t) if is_variable(t) else t for t in self._terms))
 
 
 class Literal:
-    def __init__(self, atom: Atom, negated: bool = False):
-        self._negated = negated
-        self._atom = atom
+    __slots__ = ('_atom', '_negated', '_hash', '__weakref__')
+
+    _instances = WeakValueDictionary()
+
+    def __new__(cls, atom: Atom, negated: bool = False):
+        key = (atom, negated)
+        literal = cls._instances.get(key)
+        if literal is None:
+            literal = super().__new__(cls)
+            literal._atom = atom
+            literal._negated = negated
+            literal._hash = hash(key)
+            cls._instances[key] = literal
+
+        return literal
 
     def __hash__(self) -> int:
-        return hash(self._negated) ** hash(self._atom)
+        return self._hash
 
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Literal):
-            return False
+    def __reduce__(self):
+        return Literal, (self._atom, self._negated)
 
-        if self._negated != other._negated:
-            return False
+    def __copy__(self) -> 'Literal':
+        return self
 
-        return self._atom == other._atom
+    def __deepcopy__(self, memo) -> 'Literal':
+        return self
 
     def __repr__(self) -> str:
         if self._negated:
@@ -126,6 +181,10 @@ class Literal:
 
         return repr(self._atom)
 
+    @property
+    def atom(self) -> Atom:
+        return self._atom
+
     @property
     def negated(self) -> bool:
         return self._negated
@@ -151,42 +210,48 @@ class Literal:
         if not isinstance(other, Literal):
             return None
 
-        if self.negated != other.negated:
+        if self._negated != other._negated:
             return None
 
         return self._atom.unify(other._atom)
 
     def substitute(self, substitution: Substitution) -> 'Literal':
-        return Literal(self._atom.substitute(substitution), self._negated)
+        atom = self._atom.substitute(substitution)
+        if atom is self._atom:
+            return self
+
+        return Literal(atom, self._negated)
 
 
 class Clause:
-    def __init__(self, head: Literal, body: Tuple[Literal, ...] = ()):
-        self._head = head
-        self._body = body
+    __slots__ = ('_head', '_body', '_hash', '__weakref__')
 
-    def __hash__(self) -> int:
-        value = hash(self._head)
-        for literal in self._body:
-            value = value ** hash(literal)
+    _instances = WeakValueDictionary()
 
-        return value
+    def __new__(cls, head: Literal, body: Tuple[Literal, ...] = ()):
+        body = tuple(body)
+        key = (head, body)
+        clause = cls._instances.get(key)
+        if clause is None:
+            clause = super().__new__(cls)
+            clause._head = head
+            clause._body = body
+            clause._hash = hash(key)
+            cls._instances[key] = clause
 
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Clause):
-            return False
+        return clause
 
-        if self._head != other._head:
-            return False
+    def __hash__(self) -> int:
+        return self._hash
 
-        if len(self._body) != len(other._body):
-            return False
+    def __reduce__(self):
+        return Clause, (self._head, self._body)
 
-        for i, literal in enumerate(self._body):
-            if literal != other._body[i]:
-                return False
+    def __copy__(self) -> 'Clause':
+        return self
 
-        return True
+    def __deepcopy__(self, memo) -> 'Clause':
+        return self
 
     def __repr__(self) -> str:
         if self._body:
@@ -219,6 +284,91 @@ class Clause:
         return Clause(self._head.substitute(substitution), tuple(l.substitute(substitution) for l in self._body))
 
 
+def read_clauses(stream: TextIO, size: int = 65536) -> Iterator[Clause]:
+    # Clauses in the syntax they are printed in, with '%' comments, read 'size' characters at a time.
+    return _read_clauses(_tokenize(iter(lambda: stream.read(size), '')))
+
+
+def parse(text: str) -> List[Clause]:
+    return list(_read_clauses(_tokenize([text])))
+
+
+def write_clauses(clauses: Iterable[Clause], stream: TextIO):
+    for clause in clauses:
+        stream.write('%r\n' % clause)
+
+
+def _tokenize(chunks: Iterable[str], lookahead: int = 64) -> Iterator[Tuple[str, str]]:
+    # Kinds and texts of the tokens in text arriving in chunks, holding back those near the end of what has arrived
+    # so far, which the next chunk could still change, and so only carrying that short rest over.
+    chunks, buffer, final = iter(chunks), '', False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        buffer += chunk or ''
+        position, limit = 0, len(buffer) if final else len(buffer) - lookahead
+        while position < limit:
+            match = _token_pattern.match(buffer, position)
+            if match is None:
+                start = _space_pattern.match(buffer, position).end()
+                if final or buffer[start] not in ('\'', '"'):
+                    raise ValueError('Unexpected text: %s' % buffer[start:start + 32])
+            if match is None or match.end() > limit or match.lastgroup is None:
+                break
+            yield match.lastgroup, match[match.lastgroup]
+            position = match.end()
+        buffer = buffer[position:]
+
+
+def _read_clauses(tokens: Iterator[Tuple[str, str]]) -> Iterator[Clause]:
+    for token in tokens:
+        head, token = _read_literal(token, tokens)
+        body = []
+        if token[1] == ':-':
+            while not body or token[1] == ',':
+                literal, token = _read_literal(next(tokens, _end), tokens)
+                body.append(literal)
+        if token[1] != '.':
+            raise ValueError('Expected . but found: %s' % (token[1] or 'the end'))
+
+        yield Clause(head, tuple(body))
+
+
+def _read_literal(token: Tuple[str, str], tokens: Iterator[Tuple[str, str]]) -> Tuple[Literal, Tuple[str, str]]:
+    # The literal starting with 'token', and the token after it.
+    negated = token == ('symbol', '~')
+    kind, text = next(tokens, _end) if negated else token
+    if kind not in ('name', 'string'):
+        raise ValueError('Expected a predicate but found: %s' % (text or 'the end'))
+
+    terms, token = [], next(tokens, _end)
+    if token[1] == '(':
+        token = next(tokens, _end)
+        if token[1] != ')':
+            terms.append(_read_term(*token))
+            token = next(tokens, _end)
+            while token[1] == ',':
+                terms.append(_read_term(*next(tokens, _end)))
+                token = next(tokens, _end)
+            if token[1] != ')':
+                raise ValueError('Expected , or ) but found: %s' % (token[1] or 'the end'))
+        token = next(tokens, _end)
+    functor = text if kind == 'name' else literal_eval(text)
+
+    return Literal(Atom(functor, tuple(terms)), negated), token
+
+
+def _read_term(kind: str, text: str) -> Term:
+    if kind == 'number':
+        return int(text) if text.lstrip('-').isdigit() else float(text)
+    if kind == 'name':
+        return _keywords.get(text, text)
+    if kind == 'string':
+        return literal_eval(text)
+
+    raise ValueError('Expected a term but found: %s' % (text or 'the end'))
+
+
 class Assignment:
     def __init__(self, substitution: Substitution, positive: bool):
         self._substitution = substitution
@@ -230,6 +380,15 @@ class Assignment:
             ', '.join('%s: %s' % (k, term_repr(v)) for k, v in sorted(self._substitution.items())),
         )
 
+    def __hash__(self) -> int:
+        return hash((frozenset(self._substitution.items()), self._positive))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Assignment):
+            return False
+
+        return self._positive == other._positive and self._substitution == other._substitution
+
     @property
     def substitution(self) -> Substitution:
         return self._substitution
@@ -240,28 +399,34 @@ class Assignment:
 
     def extend(self, literal: Literal, ground: List[Literal]) -> List['Assignment']:
         literal = literal.substitute(self._substitution)
-        if not literal:
-            return []
+        if literal.negated:
+            return [] if self._match(Literal(literal.atom), ground) else [self]
 
-        table = {}
-        for fact in ground:
+        result = {}
+        for fact in _lookup(literal, ground):
             substitution = literal.unify(fact)
-            if substitution:
-                for variable, constant in substitution.items():
-                    table.setdefault(variable, set()).add(constant)
-
-        result = [self]
-        for variable, constants in table.items():
-            result = [Assignment({**s._substitution, variable: c}, self._positive) for c in constants for s in result]
+            if substitution is not None:
+                result.setdefault(Assignment({**self._substitution, **substitution}, self._positive), None)
 
-        return result
+        return list(result)
 
     def satisfy(self, literal: Literal, ground: List[Literal]) -> bool:
         literal = literal.substitute(self._substitution)
-        if not literal:
-            return False
+        if literal.negated:
+            return not self._match(Literal(literal.atom), ground)
+
+        return self._match(literal, ground)
 
-        return any(bool(literal.unify(fact)) for fact in ground)
+    def covers(self, body: Iterable[Literal], ground: List[Literal]) -> bool:
+        assignments = [self]
+        for literal in body:
+            assignments = [e for a in assignments for e in a.extend(literal, ground)]
+
+        return bool(assignments)
+
+    @staticmethod
+    def _match(literal: Literal, ground: List[Literal]) -> bool:
+        return any(literal.unify(fact) is not None for fact in _lookup(literal, ground))
 
 
 class Example:
@@ -297,187 +462,1292 @@ class Example:
 
     def get_assignment(self, target: Literal) -> Optional[Assignment]:
         substitution = target.unify(self._fact)
-        if not substitution:
+        if substitution is None:
             return None
 
         return Assignment(substitution, self._positive)
 
+    @classmethod
+    def parse(cls, text: str) -> 'Example':
+        # The inverse of repr.
+        match = _sign_pattern.match(text)
+        if match is None:
+            raise ValueError('Not an example: %s' % text.strip())
+
+        tokens = _tokenize([text[match.end():]])
+        literal, token = _read_literal(next(tokens, _end), tokens)
+        if token != _end:
+            raise ValueError('Expected the end but found: %s' % token[1])
+
+        return cls(literal, match.group(1) == '+')
+
 
 class TrainingSet:
     def __init__(self, assignments: List[Assignment]):
         self._assignments = assignments
+        self._fingerprint = None
 
     def __repr__(self) -> str:
         return '\n'.join(repr(a) for a in self._assignments)
 
+    def __len__(self) -> int:
+        return len(self._assignments)
+
+    def __iter__(self) -> Iterator[Assignment]:
+        return iter(self._assignments)
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = hash((len(self._assignments), frozenset(self._assignments)))
+
+        return self._fingerprint
+
     @property
     def assignments(self) -> Iterable[Assignment]:
         return self._assignments
 
-    def extend(self, literal: Literal, ground: List[Literal]) -> Tuple[int, List[Assignment]]:
-        count, result = 0, []
+    @property
+    def positives(self) -> int:
+        return sum(1 for a in self._assignments if a.positive)
+
+    @property
+    def size(self) -> float:
+        return len(self._assignments)
+
+    def extend(self, literal: Literal, ground: List[Literal]) -> Tuple[int, 'TrainingSet']:
+        # Also counts the positive assignments with at least one extension, as needed by the gain.
+        count, result = 0, {}
         for assignment in self._assignments:
-            if assignment.satisfy(literal, ground):
+            extensions = assignment.extend(literal, ground)
+            if extensions and assignment.positive:
                 count += 1
-                for extension in assignment.extend(literal, ground):
-                    if extension not in result:
-                        result.append(extension)
+            for extension in extensions:
+                result.setdefault(extension, None)
 
-        return count, result
+        return count, TrainingSet(list(result))
 
+    def cover(self, literal: Literal, ground: List[Literal]) -> int:
+        return sum(1 for a in self._assignments if a.positive and a.satisfy(literal, ground))
 
-class Program:
-    def __init__(self, clauses: Tuple[Clause, ...]):
-        self._clauses = clauses
-        self._tabling = {}
+    def get_uncovered(self, body: Iterable[Literal], ground: List[Literal]) -> 'TrainingSet':
+        return TrainingSet([a for a in self._assignments if not a.positive or not a.covers(body, ground)])
+
+
+class Coverage:
+    # Memo of what literals do to training sets, keyed by the literals and the fingerprint of the training set,
+    # and evicting the least recently used entries beyond 'capacity'.
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+
+    def __getstate__(self):
+        return {**self.__dict__, '_memo': OrderedDict()}
+
+    def _get(self, key: Tuple, compute: Callable):
+        value = self._memo.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            value = self._memo[key] = compute()
+            if len(self._memo) > self.capacity:
+                self._memo.popitem(last=False)
+        else:
+            self.hits += 1
+            self._memo.move_to_end(key)
+
+        return value
+
+    def cover(self, training_set: 'Training', literal: Literal) -> int:
+        return self._get(('cover', literal, training_set.fingerprint), lambda: training_set.cover(literal, self))
+
+    def get_counts(self, training_set: 'Training', literal: Literal) -> Tuple[int, float, int]:
+        # The positive assignments with an extension, and the size and positives of the extended training set.
+        def compute():
+            count, extended = training_set.extend(literal, self)
+            return count, extended.size, extended.positives
+
+        return self._get(('extend', literal, training_set.fingerprint), compute)
+
+    def get_statistics(self) -> Dict[str, int]:
+        return {'size': len(self._memo), 'hits': self.hits, 'misses': self.misses}
 
-    def __hash__(self) -> int:
-        value = 1
-        for clause in self._clauses:
-            value = value ** hash(clause)
 
+class Facts(Coverage):
+    # Ground facts indexed by signature and by the constant at each position.
+    def __init__(self, ground: Iterable[Literal], capacity: int = 65536):
+        super().__init__(capacity)
+        self.facts = list(dict.fromkeys(ground))
+        self.signatures = {}
+        self.arguments = {}
+        for fact in self.facts:
+            signature = get_signature(fact)
+            self.signatures.setdefault(signature, []).append(fact)
+            for position, term in enumerate(fact.terms):
+                self.arguments.setdefault((*signature, position, term), []).append(fact)
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def __iter__(self) -> Iterator[Literal]:
+        return iter(self.facts)
+
+    def lookup(self, literal: Literal) -> List[Literal]:
+        signature, candidates = get_signature(literal), None
+        for position, term in enumerate(literal.terms):
+            if not is_variable(term):
+                bucket = self.arguments.get((*signature, position, term), [])
+                if candidates is None or len(bucket) < len(candidates):
+                    candidates = bucket
+
+        return self.signatures.get(signature, []) if candidates is None else candidates
+
+
+def _lookup(literal: Literal, ground: Union[List[Literal], Facts]) -> Iterable[Literal]:
+    return ground.lookup(literal) if isinstance(ground, Facts) else ground
+
+
+class Dictionary:
+    # Encodes constants as consecutive integers, in order of appearance.
+    def __init__(self, terms: Iterable[Term] = ()):
+        self.terms = []
+        self.codes = {}
+        for term in terms:
+            self.encode(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def encode(self, term: Term) -> int:
+        code = self.codes.get(term)
+        if code is None:
+            code = self.codes[term] = len(self.terms)
+            self.terms.append(term)
+
+        return code
+
+    def decode(self, code: int) -> Term:
+        return self.terms[code]
+
+
+class World(Coverage):
+    # Ground facts with dictionary-encoded constants, as one integer matrix of distinct rows per predicate.
+    def __init__(self, ground: Iterable[Literal], dictionary: Optional[Dictionary] = None, capacity: int = 65536):
+        if numpy is None:
+            raise ValueError('Encoded worlds need NumPy')
+
+        super().__init__(capacity)
+
+        self.dictionary = dictionary or Dictionary()
+        rows = {}
+        for fact in ground:
+            rows.setdefault(get_signature(fact), {})[tuple(map(self.dictionary.encode, fact.terms))] = None
+        self.tables = {
+            s: numpy.array(list(r), dtype=numpy.int64).reshape(len(r), s[2]) for s, r in rows.items()
+        }
+
+    def add(self, signature: Signature, rows):
+        # More encoded facts, which the memo no longer knows about.
+        table = self.tables.get(signature)
+        if table is not None:
+            rows = numpy.vstack([table, rows])
+        self.tables[signature] = numpy.unique(rows, axis=0)
+        self._memo.clear()
+
+    def get_table(self, literal: Literal):
+        # The rows matching the constants and repeated variables of 'literal', if its constants are known.
+        table = self.tables.get(get_signature(literal))
+        if table is None:
+            return numpy.zeros((0, literal.get_arity()), dtype=numpy.int64)
+
+        first = {}
+        for position, term in enumerate(literal.terms):
+            if not is_variable(term):
+                code = self.dictionary.codes.get(term)
+                if code is None:
+                    return None
+                table = table[table[:, position] == code]
+            elif first.setdefault(term, position) != position:
+                table = table[table[:, position] == table[:, first[term]]]
+
+        return table
+
+
+class ArrayTrainingSet:
+    # A training set whose assignments are the rows of an integer matrix, one column per variable, over the
+    # dictionary of a World: literals extend it by joins on sorted keys rather than one assignment at a time.
+    # Negative rows count as 'weight' each in its size, as when they are a sample of one in 'weight'.
+    def __init__(self, variables: Tuple[Variable, ...], rows, positive, dictionary: Dictionary, weight: float = 1.0):
+        self.variables = variables
+        self.rows = rows
+        self.positive = positive
+        self.dictionary = dictionary
+        self.weight = weight
+        self._fingerprint = None
+
+    @classmethod
+    def encode(cls, training_set: TrainingSet, world: World) -> 'ArrayTrainingSet':
+        assignments = list(training_set)
+        variables = tuple(dict.fromkeys(v for a in assignments for v in a.substitution))
+        rows = numpy.array([
+            [world.dictionary.encode(a.substitution[v]) for v in variables] for a in assignments
+        ], dtype=numpy.int64).reshape(len(assignments), len(variables))
+        positive = numpy.array([a.positive for a in assignments], dtype=bool)
+
+        return cls(variables, rows, positive, world.dictionary)
+
+    @classmethod
+    def read(cls, lines: Iterable[str], target: Literal, world: World, ratio: float = 1.0, chunk: int = 65536,
+             seed: int = 0) -> 'ArrayTrainingSet':
+        # Examples parsed 'chunk' lines at a time, keeping each negative one with probability 'ratio' (weighted
+        # back by its inverse) and adding the positive ones to 'world', all as encoded rows only.
+        variables = tuple(dict.fromkeys(t for t in target.terms if is_variable(t)))
+        random = numpy.random.default_rng(seed)
+        lines = (line for line in lines if line.strip())
+        rows, positive, facts = [], [], {}
+        for block in iter(lambda: list(islice(lines, chunk)), []):
+            examples = [Example.parse(line) for line in block]
+            assignments = [(e, a) for e, a in ((e, e.get_assignment(target)) for e in examples) if a is not None]
+            kept = numpy.array([a.positive for _, a in assignments], dtype=bool)
+            kept |= random.random(len(assignments)) < ratio
+            assignments = [p for p, k in zip(assignments, kept.tolist()) if k]
+            rows.append(numpy.array([
+                [world.dictionary.encode(a.substitution[v]) for v in variables] for _, a in assignments
+            ], dtype=numpy.int64).reshape(len(assignments), len(variables)))
+            positive.append(numpy.array([a.positive for _, a in assignments], dtype=bool))
+            for example in (e for e in examples if e.positive):
+                row = tuple(map(world.dictionary.encode, example.fact.terms))
+                facts.setdefault(get_signature(example.fact), {})[row] = None
+
+        for signature, table in facts.items():
+            world.add(signature, numpy.array(list(table), dtype=numpy.int64).reshape(len(table), signature[2]))
+        rows = numpy.vstack(rows) if rows else numpy.zeros((0, len(variables)), dtype=numpy.int64)
+        positive = numpy.concatenate(positive) if positive else numpy.zeros(0, dtype=bool)
+
+        return cls(variables, rows, positive, world.dictionary, 1 / ratio)
+
+    def __repr__(self) -> str:
+        return '\n'.join(repr(a) for a in self)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Assignment]:
+        terms = self.dictionary.terms
+        for row, positive in zip(self.rows.tolist(), self.positive.tolist()):
+            yield Assignment({v: terms[c] for v, c in zip(self.variables, row)}, positive)
+
+    @property
+    def assignments(self) -> Iterable[Assignment]:
+        return list(self)
+
+    @property
+    def positives(self) -> int:
+        return int(numpy.count_nonzero(self.positive))
+
+    @property
+    def size(self) -> float:
+        positives = self.positives
+        return positives + (len(self.rows) - positives) * self.weight
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = hash((
+                self.variables, self.weight, self.rows.shape, self.rows.tobytes(), self.positive.tobytes(),
+            ))
+
+        return self._fingerprint
+
+    def _match(self, literal: Literal, world: World) -> Tuple:
+        # For every row, the range of its matches among the sorted facts, with the new variables and their columns.
+        table = world.get_table(Literal(literal.atom))
+        if table is None:
+            table = numpy.zeros((0, literal.get_arity()), dtype=numpy.int64)
+
+        bound, new = [], {}
+        for position, term in enumerate(literal.terms):
+            if is_variable(term) and term in self.variables:
+                bound.append((self.variables.index(term), position))
+            elif is_variable(term):
+                new.setdefault(term, position)
+
+        left, right = _get_keys(
+            self.rows[:, [c for c, _ in bound]],
+            table[:, [p for _, p in bound]],
+        )
+        order = numpy.argsort(right, kind='stable')
+        right = right[order]
+        low = numpy.searchsorted(right, left, 'left')
+        high = numpy.searchsorted(right, left, 'right')
+
+        return table[order], low, high, new
+
+    def extend(self, literal: Literal, world: World) -> Tuple[int, 'ArrayTrainingSet']:
+        table, low, high, new = self._match(literal, world)
+        counts = high - low
+        if literal.negated:
+            keep = counts == 0
+            count = int(numpy.count_nonzero(keep & self.positive))
+            variables, rows, positive = self.variables, self.rows[keep], self.positive[keep]
+        else:
+            count = int(numpy.count_nonzero((counts > 0) & self.positive))
+            left = numpy.repeat(numpy.arange(len(self.rows)), counts)
+            right = numpy.repeat(low - (numpy.cumsum(counts) - counts), counts) + numpy.arange(len(left))
+            variables = (*self.variables, *new)
+            rows = numpy.hstack([self.rows[left], table[right][:, list(new.values())]])
+            positive = self.positive[left]
+
+        rows = numpy.unique(numpy.hstack([rows, positive[:, None]]), axis=0)
+        return count, ArrayTrainingSet(variables, rows[:, :-1], rows[:, -1] == 1, self.dictionary, self.weight)
+
+    def cover(self, literal: Literal, world: World) -> int:
+        _, low, high, _ = self._match(literal, world)
+        covered = high == low if literal.negated else high > low
+
+        return int(numpy.count_nonzero(covered & self.positive))
+
+    def get_uncovered(self, body: Iterable[Literal], world: World) -> 'ArrayTrainingSet':
+        extended = self
+        for literal in body:
+            _, extended = extended.extend(literal, world)
+
+        width = len(self.variables)
+        own, covered = _get_keys(self.rows, extended.rows[extended.positive][:, :width])
+        keep = ~(numpy.isin(own, covered) & self.positive)
+
+        return ArrayTrainingSet(self.variables, self.rows[keep], self.positive[keep], self.dictionary, self.weight)
+
+
+def _get_keys(*matrices) -> List:
+    # One integer per row, equal for equal rows across all the matrices.
+    stacked = numpy.vstack(matrices)
+    if stacked.shape[1] == 0:
+        keys = numpy.zeros(len(stacked), dtype=numpy.int64)
+    elif stacked.shape[1] == 1:
+        keys = stacked[:, 0]
+    else:
+        keys = numpy.unique(stacked, axis=0, return_inverse=True)[1].reshape(-1)
+
+    return numpy.split(keys, numpy.cumsum([len(m) for m in matrices])[:-1])
+
+
+Training = Union[TrainingSet, ArrayTrainingSet]
+Ground = Union[Facts, World]
+
+
+Adornment = str
+Derivation = List[Tuple[int, Literal, Substitution]]
+
+
+def get_signature(literal: Literal) -> Signature:
+    return literal.negated, literal.functor, literal.get_arity()
+
+
+def canonicalize(literals: Iterable[Literal]) -> Tuple[Tuple[Literal, ...], Substitution]:
+    renaming = {}
+    for literal in literals:
+        for term in literal.terms:
+            if is_variable(term) and term not in renaming:
+                renaming[term] = '_%d' % len(renaming)
+
+    return tuple(l.substitute(renaming) for l in literals), renaming
+
+
+def get_adornment(literal: Literal, bound: Iterable[Variable] = ()) -> Adornment:
+    bound = set(bound)
+    return ''.join('f' if is_variable(t) and t not in bound else 'b' for t in literal.terms)
+
+
+def get_dependency(literal: Literal) -> Signature:
+    # Negated body literals are read as negation as failure, i.e. they depend on their complement.
+    return (False, literal.functor, literal.get_arity()) if literal.negated else get_signature(literal)
+
+
+def get_safe_order(clause: Clause) -> Tuple[int, ...]:
+    # The written order of the body, except that negated literals wait for the ones binding their variables.
+    order, bound, waiting = [], set(), []
+    for i, literal in enumerate(clause.body):
+        if literal.negated:
+            waiting.append(i)
+        else:
+            order.append(i)
+            bound.update(t for t in literal.terms if is_variable(t))
+        for j in tuple(waiting):
+            if all(not is_variable(t) or t in bound for t in clause.body[j].terms):
+                waiting.remove(j)
+                order.append(j)
+    if waiting:
+        raise ValueError('Negated literals need their variables bound by positive ones: %s' % clause)
+
+    return tuple(order)
+
+
+class Table:
+    # Memo of proofs, kept as one bounded LRU partition per predicate signature. Lookups made while resolving
+    # subgoals are probes, counted apart from those of callers.
+    def __init__(self, capacity: Optional[int] = 1024):
+        self._capacity = capacity
+        self._partitions = {}
+        self.hits = 0
+        self.misses = 0
+        self.probe_hits = 0
+        self.probe_misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return sum(len(p) for p in self._partitions.values())
+
+    def __contains__(self, query: Literal) -> bool:
+        return query in self._partitions.get(get_signature(query), ())
+
+    @property
+    def capacity(self) -> Optional[int]:
+        return self._capacity
+
+    def get(self, query: Literal, default=None):
+        value = self._get(query, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def probe(self, query: Literal, default=None):
+        value = self._get(query, _missing)
+        if value is _missing:
+            self.probe_misses += 1
+            return default
+
+        self.probe_hits += 1
         return value
 
+    def _get(self, query: Literal, default):
+        partition = self._partitions.get(get_signature(query))
+        if partition is None or query not in partition:
+            return default
+
+        partition.move_to_end(query)
+        return partition[query]
+
+    def put(self, query: Literal, value):
+        partition = self._partitions.setdefault(get_signature(query), OrderedDict())
+        partition[query] = value
+        partition.move_to_end(query)
+        if self._capacity is not None:
+            while len(partition) > self._capacity:
+                partition.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, signature: Optional[Signature] = None):
+        if signature is None:
+            self._partitions.clear()
+        else:
+            self._partitions.pop(signature, None)
+
+    def get_statistics(self) -> Dict[str, int]:
+        return {
+            'size': len(self), 'hits': self.hits, 'misses': self.misses, 'probe_hits': self.probe_hits,
+            'probe_misses': self.probe_misses, 'evictions': self.evictions,
+        }
+
+
+def _walk(term: Term, frame: int, bindings: Dict) -> Union[Term, Tuple[Variable, int]]:
+    if not is_variable(term):
+        return term
+
+    term = (term, frame)
+    while term in bindings:
+        term = bindings[term]
+        if not isinstance(term, tuple):
+            break
+
+    return term
+
+
+def _reify(term: Union[Term, Tuple[Variable, int]]) -> Term:
+    return '_%s%d' % term if isinstance(term, tuple) else term
+
+
+def _unify(goal: Literal, frame: int, head: Literal, head_frame: int, bindings: Dict, trail: List) -> bool:
+    if goal.negated != head.negated:
+        return False
+
+    for term, value in zip(head.terms, goal.terms):
+        term, value = _walk(term, head_frame, bindings), _walk(value, frame, bindings)
+        if isinstance(term, tuple):
+            if term != value:
+                bindings[term] = value
+                trail.append(term)
+        elif isinstance(value, tuple):
+            bindings[value] = term
+            trail.append(value)
+        elif term != value:
+            return False
+
+    return True
+
+
+class AnswerTables:
+    # Tabled (SLG-style) resolution: every call variant gets an answer table, and the clause bodies waiting on
+    # a call (its consumers) are resumed from a worklist once with each of its answers. When the worklist runs
+    # dry, the recursive components of the incomplete calls are completed together, those they depend on first;
+    # negated calls wait until the table of their complement is complete.
+    def __init__(self, program: 'Program'):
+        self._program = program
+        self._answers = {}
+        self._completed = set()
+        self._justifications = {}
+        self._edges = {}
+        self._consumers = {}
+        self._negations = {}
+        self._tasks = []
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def clear(self):
+        self._answers.clear()
+        self._completed.clear()
+        self._justifications.clear()
+
+    def is_complete(self, call: Literal) -> bool:
+        return canonicalize([call])[0][0] in self._completed
+
+    def get_answers(self, call: Literal, deadline: Optional[float] = None) -> List[Literal]:
+        (key,), _ = canonicalize([call])
+        try:
+            return list(self._run(key, deadline))
+        finally:
+            if self._edges:
+                for key in self._edges:
+                    self._answers.pop(key, None)
+                self._edges.clear()
+                self._consumers.clear()
+                self._negations.clear()
+                self._tasks.clear()
+
+    def resolve(self, query: Literal) -> Optional[Derivation]:
+        if query not in self.get_answers(query):
+            return None
+
+        derivation, goals = [], [query]
+        while goals:
+            goal = goals.pop()
+            i, body = self._justifications[goal]
+            derivation.append((i, goal, self._program.get_clause(i).head.unify(goal)))
+            goals.extend(reversed(body))
+
+        return derivation
+
+    def _run(self, key: Literal, deadline: Optional[float] = None) -> Dict[Literal, None]:
+        # Past the deadline, the answers found so far are returned (they are sound, if maybe not all of them).
+        if key not in self._completed:
+            self._call(key)
+        while key not in self._completed:
+            while self._tasks:
+                if deadline is not None and perf_counter() > deadline:
+                    return self._answers[key]
+                self._step(*self._tasks.pop())
+            self._complete()
+
+        return self._answers[key]
+
+    def _call(self, key: Literal):
+        self._answers[key] = {}
+        self._edges[key] = set()
+        self._consumers[key] = []
+        for i in self._program.get_candidates(key):
+            clause = self._program.get_clause(i)
+            substitution = {}
+            for term, value in zip(clause.head.terms, key.terms):
+                if is_variable(value):
+                    continue
+                if not is_variable(term):
+                    if term != value:
+                        break
+                elif substitution.setdefault(term, value) != value:
+                    break
+            else:
+                body = tuple(clause.body[j] for j in get_safe_order(clause))
+                self._tasks.append(((key, i, body, 0, substitution, (), None), None))
+
+    def _step(self, consumer: Tuple, answer: Optional[Literal]):
+        # Runs the body of a clause of a call from a position, given the answer for the goal waiting there, until
+        # it waits on another goal or derives an answer.
+        key, i, body, j, substitution, support, goal = consumer
+        if answer is not None:
+            match = goal.unify(answer)
+            if match is None:
+                return
+            j, substitution, support = j + 1, {**substitution, **match}, (*support, answer)
+
+        while j < len(body):
+            goal = body[j].substitute(substitution)
+            (callee,), _ = canonicalize([Literal(goal.atom)])
+            if callee not in self._completed and callee not in self._edges:
+                self._call(callee)
+            consumer = (key, i, body, j, substitution, support, goal)
+            if callee not in self._completed:
+                self._edges[key].add(callee)
+                if goal.negated:
+                    self._negations.setdefault(key, []).append((callee, consumer))
+                else:
+                    self._consumers[callee].append(consumer)
+            if not goal.negated:
+                self._tasks.extend((consumer, a) for a in self._answers[callee])
+                return
+            if callee not in self._completed or Literal(goal.atom) in self._answers[callee]:
+                return
+            j += 1
+
+        self._add(key, i, substitution, support)
+
+    def _add(self, key: Literal, i: int, substitution: Substitution, support: Tuple[Literal, ...]):
+        clause = self._program.get_clause(i)
+        answer = clause.head.substitute(substitution)
+        if not answer.is_ground():
+            raise ValueError('Tabled resolution needs range-restricted clauses: %s' % clause)
+
+        answers = self._answers[key]
+        if answer not in answers and key.unify(answer) is not None:
+            answers[answer] = None
+            self._justifications.setdefault(answer, (i, support))
+            self._tasks.extend((c, answer) for c in self._consumers[key])
+
+    def _complete(self):
+        # With no work left, a component of incomplete calls that only depends on complete ones is complete too,
+        # unless some of its negated calls are still waiting (on complete calls by then): those are resumed.
+        graph = {k: {c for c in edges if c in self._edges} for k, edges in self._edges.items()}
+        index, lowlink, components = {}, {}, []
+        for start in graph:
+            if start not in index:
+                _connect(start, graph, index, lowlink, components)
+
+        for component in components:
+            waiting = [w for key in component for w in self._negations.pop(key, ())]
+            for callee, consumer in waiting:
+                if callee in component:
+                    raise ValueError('Negation through recursion is not stratified: %s' % consumer[-1])
+            if waiting:
+                self._tasks.extend((consumer, None) for _, consumer in waiting)
+                return
+
+            for key in component:
+                self._completed.add(key)
+                del self._edges[key]
+                del self._consumers[key]
+
+
+class Planner:
+    # Orders rule bodies so that the most selective literals, given the variables bound so far, come first.
+    # Estimates assume independent arguments: the cardinality of a predicate divided by the number of distinct
+    # values of each bound argument; predicates without facts are assumed as large as the largest one. Literals
+    # of the recursive component of the head never go before the positive ones written before them that share
+    # some of their variables, so that plans never make recursion unbounded (which estimates cannot see).
+    def __init__(self, program: 'Program'):
+        self._program = program
+        self._statistics = None
+        self._components = None
+        self._plans = {}
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def clear(self):
+        self._statistics = None
+        self._components = None
+        self._plans.clear()
+
+    def get_statistics(self, signature: Signature) -> Tuple[int, Tuple[int, ...]]:
+        if self._statistics is None:
+            self._statistics = {}
+            for clause in self._program.get_facts():
+                rows = self._statistics.setdefault(get_signature(clause.head), set())
+                rows.add(tuple(clause.head.terms))
+            self._statistics = {
+                s: (len(rows), tuple(len(set(column)) for column in zip(*rows)))
+                for s, rows in self._statistics.items()
+            }
+            largest = max((c for c, _ in self._statistics.values()), default=1)
+            self._default = largest, max(1, int(largest ** 0.5))
+
+        statistics = self._statistics.get(signature)
+        if statistics is None:
+            cardinality, distinct = self._default
+            statistics = cardinality, (distinct,) * signature[2]
+
+        return statistics
+
+    def estimate(self, literal: Literal, bound: Iterable[Variable]) -> float:
+        if literal.negated:
+            return 1.0 if all(not is_variable(t) or t in bound for t in literal.terms) else inf
+
+        cardinality, distinct = self.get_statistics(get_signature(literal))
+        estimate, seen = float(cardinality), set()
+        for position, term in enumerate(literal.terms):
+            if not is_variable(term) or term in bound or term in seen:
+                estimate /= max(1, distinct[position])
+            seen.add(term)
+
+        return estimate
+
+    def plan(self, clause: Clause, adornment: Optional[Adornment] = None) -> Tuple[int, ...]:
+        adornment = adornment or 'f' * clause.head.get_arity()
+        order = self._plans.get((clause, adornment))
+        if order is None:
+            order = self._plans[(clause, adornment)] = tuple(i for i, _ in self._order(clause, adornment))
+
+        return order
+
+    def _order(self, clause: Clause, adornment: Adornment) -> List[Tuple[int, float]]:
+        bound = {t for t, a in zip(clause.head.terms, adornment) if a == 'b' and is_variable(t)}
+        recursive = self._get_recursive(clause)
+        remaining, order = list(enumerate(clause.body)), []
+        while remaining:
+            ready = [(i, l) for i, l in remaining if i not in recursive or not _is_bound_before(i, l, remaining)]
+            estimates = [self.estimate(literal, bound) for _, literal in ready]
+            best = estimates.index(min(estimates))
+            if estimates[best] == inf:
+                raise ValueError('Negated literals need their variables bound by positive ones: %s' % clause)
+
+            i, literal = ready[best]
+            remaining.remove((i, literal))
+            order.append((i, estimates[best]))
+            bound.update(t for t in literal.terms if is_variable(t))
+
+        return order
+
+    def _get_recursive(self, clause: Clause) -> Set[int]:
+        if self._components is None:
+            components = get_components(self._program.clauses)
+            self._components = {s: i for i, component in enumerate(components) for s in component}
+
+        head = self._components.get(get_signature(clause.head))
+        return {i for i, l in enumerate(clause.body) if self._components.get(get_dependency(l), -1) == head}
+
+    def explain(self, clause: Clause, adornment: Optional[Adornment] = None) -> str:
+        adornment = adornment or 'f' * clause.head.get_arity()
+        lines = ['%s  [%s]' % (clause, adornment)]
+        for step, (i, estimate) in enumerate(self._order(clause, adornment), 1):
+            lines.append('  %d. %s  (~%.1f rows)' % (step, clause.body[i], estimate))
+
+        return '\n'.join(lines)
+
+
+def _is_bound_before(index: int, literal: Literal, remaining: List[Tuple[int, Literal]]) -> bool:
+    # Whether a positive literal written before 'literal' and not placed yet shares one of its variables.
+    variables = {t for t in literal.terms if is_variable(t)}
+    return any(i < index and not l.negated and variables.intersection(l.terms) for i, l in remaining)
+
+
+class Program:
+    def __init__(self, clauses: Tuple[Clause, ...], indexes: Tuple[int, ...] = (0,),
+                 capacity: Optional[int] = 1024):
+        self._clauses = []
+        self._indexes = indexes
+        self._signatures = {}
+        self._arguments = {}
+        self._variables = {}
+        self._tabling = Table(capacity)
+        self._tables = AnswerTables(self)
+        self._network = None
+        self._magic = {}
+        self._planner = Planner(self)
+        self._stratified = False
+        self._relations = None
+        self._modes = {}
+        self._types = {}
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def __hash__(self) -> int:
+        return hash(frozenset(self.clauses))
+
     def __eq__(self, other) -> bool:
         if not isinstance(other, Program):
             return False
 
-        if len(self._clauses) != len(other._clauses):
+        clauses, others = self.clauses, other.clauses
+        if len(clauses) != len(others):
             return False
 
-        return all(c in other._clauses for c in self._clauses)
+        return set(clauses) == set(others)
 
     def __repr__(self) -> str:
-        return '\n'.join(repr(c) for c in self._clauses)
+        return '\n'.join(repr(c) for c in self.clauses)
+
+    @classmethod
+    def load(cls, path: str, indexes: Tuple[int, ...] = (0,), capacity: Optional[int] = 1024) -> 'Program':
+        with open(path) as stream:
+            return cls(tuple(read_clauses(stream)), indexes, capacity)
+
+    def save(self, path: str):
+        with open(path, 'w') as stream:
+            write_clauses(self.clauses, stream)
 
     @property
     def clauses(self) -> Iterable[Clause]:
-        return self._clauses
+        return [c for c in self._clauses if c is not None]
+
+    @property
+    def tabling(self) -> Table:
+        return self._tabling
+
+    @property
+    def planner(self) -> Planner:
+        return self._planner
 
     def get_clause(self, index: int) -> Optional[Clause]:
         return self._clauses[index] if 0 <= index < len(self._clauses) else None
 
+    def add_clauses(self, clauses: Iterable[Clause]):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def add_clause(self, clause: Clause):
+        index = len(self._clauses)
+        self._clauses.append(clause)
+
+        head = clause.head
+        signature = get_signature(head)
+        self._signatures.setdefault(signature, []).append(index)
+        for position in self._indexes:
+            if position < len(head.terms):
+                term = head.terms[position]
+                if is_variable(term):
+                    self._variables.setdefault((*signature, position), []).append(index)
+                else:
+                    self._arguments.setdefault((*signature, position, term), []).append(index)
+
+        if not clause.is_fact():
+            self._network = None
+        elif self._network is not None:
+            self._network.assert_facts([clause.head])
+        self.invalidate()
+
+    def retract(self, literal: Literal) -> bool:
+        clause = Clause(literal)
+        signature = get_signature(literal)
+        for index in self._get_candidates(signature, literal.terms):
+            if self._clauses[index] is clause:
+                break
+        else:
+            return False
+
+        self._clauses[index] = None
+        buckets = [self._signatures[signature]]
+        for position in self._indexes:
+            if position < len(literal.terms):
+                term = literal.terms[position]
+                if is_variable(term):
+                    buckets.append(self._variables[(*signature, position)])
+                else:
+                    buckets.append(self._arguments[(*signature, position, term)])
+        for bucket in buckets:
+            del bucket[bisect_left(bucket, index)]
+
+        if self._network is not None and all(self._clauses[i] is not clause for i in buckets[0]):
+            self._network.retract(literal)
+        self.invalidate()
+
+        return True
+
+    def invalidate(self, signature: Optional[Signature] = None):
+        # Drops the cached proofs of 'signature' and of every predicate depending on it, or all of them without one.
+        if signature is None:
+            self._tabling.invalidate()
+        else:
+            for dependent in self._get_dependents(signature):
+                self._tabling.invalidate(dependent)
+        self._tables.clear()
+        self._magic.clear()
+        self._planner.clear()
+        self._stratified = False
+        self._relations = None
+
+    def _get_dependents(self, signature: Signature) -> Set[Signature]:
+        dependents = {}
+        for clause in self.clauses:
+            for literal in clause.body:
+                dependents.setdefault(get_dependency(literal), set()).add(get_signature(clause.head))
+
+        result, pending = {signature}, [signature]
+        while pending:
+            for dependent in dependents.get(pending.pop(), ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    pending.append(dependent)
+
+        return result
+
+    def get_candidates(self, query: Literal) -> List[int]:
+        return self._get_candidates(get_signature(query), query.terms)
+
+    def _get_candidates(self, signature: Signature, terms: Tuple[Term, ...]) -> List[int]:
+        candidates = self._signatures.get(signature, [])
+        for position in self._indexes:
+            if position < len(terms) and not is_variable(terms[position]):
+                bound = self._arguments.get((*signature, position, terms[position]), [])
+                free = self._variables.get((*signature, position), [])
+                if len(bound) + len(free) < len(candidates):
+                    candidates = list(merge(bound, free)) if bound and free else bound or free
+
+        return candidates
+
     def get_constants(self) -> List[Term]:
-        return sorted({t for c in self._clauses for l in c.literals for t in l.terms if not is_variable(t)})
+        return sorted({t for c in self.clauses for l in c.literals for t in l.terms if not is_variable(t)})
 
     def get_facts(self) -> Iterable[Clause]:
-        return [f for f in self._clauses if f.is_fact()]
+        return [f for f in self.clauses if f.is_fact()]
 
     def get_rules(self) -> Iterable[Clause]:
-        return (fact for fact in self._clauses if not fact.is_fact())
+        return (fact for fact in self.clauses if not fact.is_fact())
 
     def is_ground(self) -> bool:
-        return all(c.is_ground() for c in self._clauses)
+        return all(c.is_ground() for c in self.clauses)
 
-    def resolve(self, query: Literal) -> Optional[List[Tuple[int, Literal, Substitution]]]:
+    def resolve(self, query: Literal, tabled: bool = False) -> Optional[Derivation]:
         if not query.is_ground():
             raise ValueError("'query' must be ground: %s" % query)
 
-        return self._tabling.setdefault(query, self._resolve(query))
-
-    def _resolve(self, query: Literal) -> Optional[List[Tuple[int, Literal, Substitution]]]:
-        for i, clause in enumerate(self._clauses):
-            substitution = clause.head.unify(query)
-            if substitution is None:
+        if tabled:
+            return self._tables.resolve(query)
+
+        derivation = self._tabling.get(query, _missing)
+        if derivation is _missing:
+            derivation = self._resolve(query)
+            self._tabling.put(query, derivation)
+
+        return derivation
+
+    def get_answers(self, query: Literal) -> List[Literal]:
+        return self._tables.get_answers(query)
+
+    def solve(self, query: Literal, limit: Optional[int] = None, timeout: Optional[float] = None,
+              tabled: bool = False) -> Iterator[Substitution]:
+        if limit is not None and limit <= 0:
+            return
+
+        deadline = None if timeout is None else perf_counter() + timeout
+        if tabled:
+            answers = (query.unify(a) for a in self._tables.get_answers(query, deadline))
+        else:
+            answers = (s for s, _ in self._sld(query, deadline))
+
+        seen = set()
+        for substitution in answers:
+            key = tuple(sorted(substitution.items(), key=repr))
+            if key not in seen:
+                seen.add(key)
+                yield substitution
+                if len(seen) == limit:
+                    return
+
+    def _resolve(self, query: Literal) -> Optional[Derivation]:
+        return next((derivation for _, derivation in self._sld(query)), None)
+
+    def _sld(self, query: Literal, deadline: Optional[float] = None) -> Iterator[Tuple[Substitution, Derivation]]:
+        # Depth-first SLD resolution driven by explicit goal and choice point stacks rather than recursion.
+        # Clause variables are kept apart by frame, bindings are undone through a trail on backtracking,
+        # while goals and the proof trace are linked lists sharing their tails.
+        bindings, trail, stack, frames = {}, [], [], count(1)
+        goals, trace = (query, 0, None), None
+        while True:
+            if goals is None:
+                substitution = {t: _reify(_walk(t, 0, bindings)) for t in query.terms if is_variable(t)}
+                yield substitution, self._get_derivation(trace, bindings)
+
+            elif goals[0] is None:
+                del stack[goals[1]:]
+                goals = goals[2]
                 continue
 
-            derivation = [(i, query, substitution)]
-            if not clause.body:
-                return derivation
-
-            for query in clause.body:
-                substituted = query.substitute(substitution)
-                sub_goal = self.resolve(substituted)
-                if not sub_goal:
-                    return None
-
-                derivation = [*derivation, *sub_goal]
+            elif goals[0].negated:
+                literal, frame, rest = goals
+                if not self._is_provable(literal, frame, bindings):
+                    goals = rest
+                    continue
 
-            return derivation
+            else:
+                tabled = self._expand(goals, trace, stack, bindings, trail)
+                if tabled is not None:
+                    goals, trace = tabled
+                    continue
+
+            goals, trace = self._retry(stack, bindings, trail, frames)
+            if goals is _missing or deadline is not None and perf_counter() > deadline:
+                return
+
+    def _expand(self, goals: Tuple, trace: Tuple, stack: List[List], bindings: Dict, trail: List) -> Optional[Tuple]:
+        # The remaining goals and trace if the first goal is ground and resolved already, else None after pushing
+        # a choice point for it (none if it is known to fail). Ground subgoals mark where their choice points start.
+        literal, frame, rest = goals
+        terms = tuple(_walk(t, frame, bindings) for t in literal.terms)
+        if frame and not any(isinstance(t, tuple) for t in terms):
+            derivation = self._tabling.probe(Literal(Atom(literal.functor, terms), literal.negated), _missing)
+            if derivation is not _missing:
+                return None if derivation is None else (rest, (derivation, trace))
+
+            rest = (None, len(stack), rest)
+
+        terms = tuple('_' if isinstance(t, tuple) else t for t in terms)
+        candidates = self._get_candidates(get_signature(literal), terms)
+        stack.append([literal, frame, rest, trace, len(trail), candidates, 0])
 
         return None
 
-    def get_world(self) -> List[Literal]:
-        table = {}
-        clauses = []
-        root = Root()
-        for rule in self._clauses:
-            if rule.is_fact():
-                clauses.append(rule)
+    def _retry(self, stack: List[List], bindings: Dict, trail: List, frames: Iterator[int]) -> Tuple:
+        while stack:
+            choice = stack[-1]
+            literal, frame, rest, trace, mark, candidates, position = choice
+            while len(trail) > mark:
+                del bindings[trail.pop()]
+
+            if position + 1 >= len(candidates):
+                stack.pop()
             else:
-                beta = None
-                for lit in rule.body:
-                    name = repr(lit)
-                    alpha = table.setdefault(name, Alpha(lit, root))
-                    if beta is None:
-                        beta = alpha
-                    else:
-                        name = '%s, %s' % (beta.name, alpha.name)
-                        beta = table.setdefault(name, Beta(beta, alpha))
-                Leaf(rule, beta, root, clauses)
+                choice[6] = position + 1
+            if position >= len(candidates):
+                continue
 
-        for fact in self.get_facts():
-            root.notify(fact.head)
+            clause, clause_frame = self._clauses[candidates[position]], next(frames)
+            if _unify(literal, frame, clause.head, clause_frame, bindings, trail):
+                for body in reversed(self._get_body(clause, clause_frame, bindings)):
+                    rest = (body, clause_frame, rest)
 
-        return list({c.head for c in clauses})
+                return rest, ((candidates[position], literal, frame, clause_frame), trace)
 
-    def foil(self, target: Literal, examples: List[Example]) -> List[Clause]:
-        training_set = TrainingSet([e.get_assignment(target) for e in examples])
+        return _missing, None
 
-        ground = self.get_world()
+    def _is_provable(self, literal: Literal, frame: int, bindings: Dict) -> bool:
+        # Negated goals are proven by failing to prove their complement, whose outcome is memoized by resolve.
+        terms = tuple(_walk(t, frame, bindings) for t in literal.terms)
+        if any(isinstance(t, tuple) for t in terms):
+            raise ValueError('Negated goals must be ground when selected: %s' % literal)
 
-        clauses = []
-        while any(e.positive for e in training_set.assignments):
-            clause = self.new_clause(target, training_set)
-            if not clause:
-                raise ValueError("Shouldn't have happened")
+        if not self._stratified:
+            get_strata(self.clauses)
+            self._stratified = True
 
-            clauses.append(clause)
-            training_set = TrainingSet([a for a in training_set.assignments if not a.satisfy(target, ground)])
+        return self.resolve(Literal(Atom(literal.functor, terms))) is not None
 
-        return clauses
+    def _get_body(self, clause: Clause, frame: int, bindings: Dict) -> Tuple[Literal, ...]:
+        if len(clause.body) < 2:
+            return clause.body
 
-    def new_clause(self, target: Literal, training_set: TrainingSet) -> Clause:
-        body, current_examples = [], training_set
-        while any(not e.positive for e in current_examples):
-            candidates = self.new_literals(target, body)
-            literal, extended_examples = self.choose_literal(candidates, current_examples)
-            if literal:
-                body = (*body, literal)
-                current_examples = extended_examples
+        adornment = ''.join('f' if isinstance(_walk(t, frame, bindings), tuple) else 'b' for t in clause.head.terms)
+        return tuple(clause.body[i] for i in self._planner.plan(clause, adornment))
 
-        return Clause(target, body)
+    def explain(self, query: Literal) -> str:
+        adornment = get_adornment(query)
+        return '\n'.join(
+            self._planner.explain(self._clauses[i], adornment)
+            for i in self.get_candidates(query) if not self._clauses[i].is_fact()
+        )
 
-    def choose_literal(self, literals: List[Literal], training_set: TrainingSet) -> Tuple[Literal, List[Example]]:
-        best, literal, extended_examples = None, None, training_set
-        for literal in literals:
-            max_gain = cover(extended_examples, literal) * information(extended_examples)
-            if best is not None and max_gain < best:
-                continue
+    def _get_derivation(self, trace: Tuple, bindings: Dict) -> Derivation:
+        derivation = []
+        while trace is not None:
+            step, trace = trace
+            if isinstance(step, list):
+                derivation.extend(reversed(step))
+            else:
+                i, literal, frame, clause_frame = step
+                head = self._clauses[i].head
+                goal = literal.substitute({t: _reify(_walk(t, frame, bindings)) for t in literal.terms})
+                substitution = {t: _reify(_walk(t, clause_frame, bindings)) for t in head.terms if is_variable(t)}
+                derivation.append((i, goal, substitution))
+        derivation.reverse()
 
-            # future_examples = []
-            # for example in extended_examples:
-            #     for e in example.extend(literal, self.get_constants()):
-            #         if e not in future_examples:
-            #             future_examples.append(e)
+        return derivation
 
-            future_examples = [ee for e in extended_examples for ee in e.extend(literal, self.get_constants())]
-            gain = cover(examples, literal) * (information(examples) - information(future_examples))
-            if best is None or gain > best:
-                best, literal, extended_examples = gain, literal, future_examples
+    def get_network(self) -> 'Network':
+        if self._network is None:
+            self._network = Network(self.get_rules(), self._planner)
+            self._network.assert_facts(fact.head for fact in self.get_facts())
 
-        return literal, extended_examples
+        return self._network
+
+    def get_world(self) -> List[Literal]:
+        return self.get_network().get_world()
+
+    def evaluate(self, matrices: bool = False) -> List[Literal]:
+        return Evaluator(self.clauses, matrices).run().get_world()
+
+    def query(self, query: Literal) -> List[Literal]:
+        signature, adornment = get_signature(query), get_adornment(query)
+        if not any(not self._clauses[i].is_fact() for i in self._signatures.get(signature, ())):
+            return [self._clauses[i].head for i in self.get_candidates(query)
+                    if query.unify(self._clauses[i].head) is not None]
+
+        rewritten = self._magic.get((signature, adornment))
+        if rewritten is None:
+            rewritten = self._magic[(signature, adornment)] = magic_sets(self.clauses, query)
+
+        evaluator = Evaluator([*rewritten, Clause(_magic(query, adornment))], relations=self._get_relations()).run()
+        relation = evaluator.get_relation(get_signature(_adorned(query, adornment)))
+        answers = (Literal(Atom(query.functor, row), query.negated) for row in relation)
+
+        return [a for a in answers if query.unify(a) is not None]
+
+    def _get_relations(self) -> Dict[Signature, 'Relation']:
+        # The facts of the predicates that no rule defines, kept across queries along with their indexes.
+        if self._relations is None:
+            derived = {get_signature(c.head) for c in self.clauses if not c.is_fact()}
+            self._relations = {}
+            for clause in self.clauses:
+                signature = get_signature(clause.head)
+                if signature not in derived:
+                    if not clause.is_ground():
+                        raise ValueError('Bottom-up evaluation needs ground facts: %s' % clause)
+                    self._relations.setdefault(signature, Relation()).add(tuple(clause.head.terms))
+
+        return self._relations
+
+    def foil(self, target: Literal, examples: List[Example], workers: Optional[int] = None,
+             chunksize: int = 16, arrays: bool = False, width: int = 1) -> List[Clause]:
+        # With 'workers', candidate literals are scored in chunks of 'chunksize' by a process pool, which receives
+        # the ground facts once when it starts. With 'arrays', training sets are ArrayTrainingSets over a World.
+        # Clauses are searched with a beam of 'width' bodies, which with the default of one is greedy.
+        ground = [*self.get_world(), *(e.fact for e in examples if e.positive)]
+        training_set = TrainingSet([a for a in (e.get_assignment(target) for e in examples) if a is not None])
+        if arrays:
+            ground = World(ground)
+            training_set = ArrayTrainingSet.encode(training_set, ground)
+        else:
+            ground = Facts(ground)
+
+        return self._learn(target, training_set, ground, workers, chunksize, width)
+
+    def foil_file(self, target: Literal, path: str, ratio: float = 1.0, chunk: int = 65536, seed: int = 0,
+                  workers: Optional[int] = None, chunksize: int = 16, width: int = 1) -> List[Clause]:
+        # Like foil with 'arrays', for the examples of a file with one per line as printed, read 'chunk' lines at a
+        # time and keeping only a 'ratio' sample of the negative ones.
+        if not 0 < ratio <= 1:
+            raise ValueError('The ratio of negative examples to keep should be in (0, 1]: %s' % ratio)
+
+        world = World(self.get_world())
+        with open(path) as lines:
+            training_set = ArrayTrainingSet.read(lines, target, world, ratio, chunk, seed)
+
+        return self._learn(target, training_set, world, workers, chunksize, width)
+
+    def _learn(self, target: Literal, training_set: Training, ground: Ground, workers: Optional[int] = None,
+               chunksize: int = 16, width: int = 1) -> List[Clause]:
+        executor = ProcessPoolExecutor(workers, initializer=_set_ground, initargs=(ground,)) if workers else None
+        try:
+            clauses = []
+            while training_set.positives:
+                clause = self.new_clause(target, training_set, ground, executor, chunksize, width)
+                clauses.append(clause)
+                training_set = training_set.get_uncovered(clause.body, ground)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return clauses
 
-    def new_literals(self, head: Literal, body: List[Literal]) -> List[Literal]:
-        literals = []
-        count = self._count(head, body)
-        for negated, functor, arity in self._get_signatures():
-            for indexes in self._get_indexes(count, arity):
-                literal = Literal(Atom(functor, tuple('V%d' % i for i in indexes)), negated)
-                if literal not in literals:
-                    literals.append(literal)
+    def new_clause(self, target: Literal, training_set: Training, ground: Ground,
+                   executor: Optional[Executor] = None, chunksize: int = 16, width: int = 1) -> Clause:
+        # Beam search over bodies ranked by their total gain, keeping the 'width' best at each step, among those
+        # extended by a literal with a positive gain. Literals whose bound can't reach the 'width' best totals of
+        # distinct bodies of the step aren't scored, and a body reached in several orders keeps its best total.
+        # Shorter consistent bodies are preferred, so the search stops at the first step that finds some.
+        beam = [((), training_set, 0.0)]
+        while True:
+            bests, totals, children = [-inf] * width, {}, {}
+            for body, examples, total in beam:
+                if len(examples) == examples.positives:
+                    return Clause(target, body)
+
+                hopeless = {}
+                literals = self.new_literals(target, body, hopeless)
+                scores = self.score_literals(literals, examples, ground, executor, chunksize, hopeless, total, bests,
+                                             totals, body)
+                for literal, g in scores:
+                    key = frozenset((*body, literal))
+                    if g > 0 and (key not in children or total + g > children[key][0]):
+                        children.pop(key, None)
+                        children[key] = total + g, body, examples, literal
+
+            if not children:
+                raise ValueError('No literal has a positive gain for: %s' % Clause(target, beam[0][0]))
+
+            beam, consistent = [], []
+            for total, body, examples, literal in sorted(children.values(), key=lambda c: -c[0])[:width]:
+                examples = examples.extend(literal, ground)[1]
+                if len(examples) == examples.positives:
+                    consistent.append((*body, literal))
+                beam.append(((*body, literal), examples, total))
+            if consistent:
+                return Clause(target, consistent[0])
+
+    def choose_literal(self, literals: Iterable[Literal], training_set: Training, ground: Ground,
+                       executor: Optional[Executor] = None, chunksize: int = 16,
+                       hopeless: Optional[Dict[Signature, List[Literal]]] = None) -> Tuple[Optional[Literal], Training]:
+        # The first literal with the highest gain.
+        scores = self.score_literals(literals, training_set, ground, executor, chunksize, hopeless)
+        best = max(range(len(scores)), key=lambda i: scores[i][1], default=None)
+        if best is None or scores[best][1] == -inf:
+            return None, training_set
+
+        literal = scores[best][0]
+        return literal, training_set.extend(literal, ground)[1]
 
-        return literals
+    @staticmethod
+    def score_literals(literals: Iterable[Literal], training_set: Training, ground: Ground,
+                       executor: Optional[Executor] = None, chunksize: int = 16,
+                       hopeless: Optional[Dict[Signature, List[Literal]]] = None, offset: float = 0.0,
+                       bests: Optional[List[float]] = None, totals: Optional[Dict[FrozenSet[Literal], float]] = None,
+                       body: Tuple[Literal, ...] = ()) -> List[Tuple[Literal, float]]:
+        # Gains of the literals, scored here or by 'executor' in chunks as generated (each pruned on its own).
+        if executor is None:
+            return _score(literals, training_set, ground, hopeless, offset, bests, totals, body)
+
+        literals = iter(literals)
+        chunks = iter(lambda: list(islice(literals, chunksize)), [])
+        bests = [-inf] * (1 if bests is None else len(bests))
+        options = repeat(training_set), repeat(None), repeat(None), repeat(0.0), repeat(bests)
+        scores = executor.map(_score, chunks, *options)
+        return [s for chunk in scores for s in chunk]
+
+    def declare(self, signature: Signature, modes: Optional[str] = None, types: Optional[Tuple[str, ...]] = None):
+        # Restricts the candidate literals of a predicate: '+' positions take variables of the clause so far,
+        # '-' positions also new ones, and variables only go where their type (if any) is the same.
+        if modes is not None:
+            self._modes[signature] = modes
+        if types is not None:
+            self._types[signature] = types
+
+    def new_literals(self, head: Literal, body: Iterable[Literal],
+                     hopeless: Optional[Dict[Signature, List[Literal]]] = None) -> Iterator[Literal]:
+        # Literals are generated lazily, signature by signature and fewest old variables first, with new variables
+        # numbered by first occurrence so that no two of them only differ by renaming. Positive literals placing
+        # the old variables of one in 'hopeless' cannot cover more and are skipped before being built. Recursive
+        # literals need an old variable other than the one of the head in the same position to make progress.
+        variables = list(dict.fromkeys(t for l in (head, *body) for t in l.terms if is_variable(t)))
+        old, kinds = set(variables), self._get_kinds((head, *body))
+        signatures = self._get_signatures()
+        if get_signature(head) not in signatures:
+            signatures.append(get_signature(head))
+        for signature in signatures:
+            negated, functor, arity = signature
+            names = [*variables, *(v for v in ('V%d' % i for i in range(len(variables) + arity)) if v not in variables)]
+            slots = self._get_slots(signature, variables, kinds)
+            for pattern in self._get_patterns(len(variables), slots):
+                placed = frozenset((p, variables[i]) for p, i in enumerate(pattern) if i < len(variables))
+                if hopeless and not negated and any(
+                    all((p, t) in placed for p, t in enumerate(h.terms) if t in old)
+                    for h in hopeless.get(signature, ())
+                ):
+                    continue
+                if signature == get_signature(head) and all(head.terms[p] == v for p, v in placed):
+                    continue
+
+                yield Literal(Atom(functor, tuple(names[i] for i in pattern)), negated)
 
     def extend(self, example: Example, literal: Literal) -> List[Example]:
         raise NotImplementedError
@@ -493,153 +1763,995 @@ class Program:
     #
     #     return count, result
 
-    def _get_signatures(self) -> List[Tuple[bool, str, int]]:
-        signatures = []
-        for clause in self._clauses:
-            signature = (clause.head.negated, clause.head.functor, clause.head.get_arity())
-            if signature not in signatures:
-                signatures.append(signature)
+    def _get_signatures(self) -> List[Signature]:
+        return list(self._signatures)
 
-        return signatures
+    def _get_kinds(self, literals: Iterable[Literal]) -> Dict[Variable, str]:
+        kinds = {}
+        for literal in literals:
+            types = self._types.get(get_signature(literal), ())
+            for term, kind in zip(literal.terms, types):
+                if is_variable(term) and kind is not None:
+                    kinds.setdefault(term, kind)
+
+        return kinds
+
+    def _get_slots(self, signature: Signature, variables: List[Variable],
+                   kinds: Dict[Variable, str]) -> List[Tuple[List[int], bool, Optional[str]]]:
+        # For every position: the old variables that fit, whether a new one may go there, and its type.
+        modes = self._modes.get(signature, '-' * signature[2])
+        types = self._types.get(signature, (None,) * signature[2])
+        return [
+            ([i for i, v in enumerate(variables) if kind is None or kinds.get(v, kind) == kind], mode != '+', kind)
+            for mode, kind in zip(modes, types)
+        ]
 
     @staticmethod
-    def _count(head: Literal, body: List[Literal]) -> int:
-        indexes = {}
-        for literal in [*body, head]:
-            for term in literal.terms:
-                if is_variable(term):
-                    indexes.setdefault(term, len(indexes))
+    def _get_patterns(count: int, slots: List[Tuple[List[int], bool, Optional[str]]]) -> Iterator[Tuple[int, ...]]:
+        # Indexes below 'count' refer to old variables, the others to new ones in order of first occurrence.
+        def extend(pattern: Tuple[int, ...], olds: int, news: List[Optional[str]]) -> Iterator[Tuple[int, ...]]:
+            if len(pattern) == len(slots):
+                if olds == target:
+                    yield pattern
+                return
 
-        return len(indexes)
-
-    @staticmethod
-    def _get_indexes(count: int, arity: int) -> List[List[int]]:
-        items = [[]]
-        for _ in range(arity):
-            updates = []
-            for combination in items:
-                for current in range(count + arity - 1):
-                    update = [*combination, current]
-                    updates.append(update)
-            items = updates
-        valid_items = [p for p in items if any(i < count for i in p)]
+            position = len(pattern)
+            indexes, new, kind = slots[position]
+            if olds < target:
+                for i in indexes:
+                    yield from extend((*pattern, i), olds + 1, news)
+            if new and target - olds < len(slots) - position:
+                for j, other in enumerate(news):
+                    if kind is None or other is None or kind == other:
+                        yield from extend((*pattern, count + j), olds, news)
+                yield from extend((*pattern, count + len(news)), olds, [*news, kind])
 
-        return sorted(valid_items, key=lambda x: sum(1 for i in x if i < count))
+        for target in range(1, len(slots) + 1):
+            yield from extend((), 0, [])
 
 
-Payload = Tuple[List[Literal], Substitution]
+Token = Tuple[Literal, ...]
 
 
 class Root:
-    def __init__(self):
-        self.children = set()
+    # Facts are dispatched on their signature and, where alpha patterns have constants, on the first of them.
+    def __init__(self, discriminate: bool = True):
+        self.discriminate = discriminate
+        self.children = {}
+        self.positions = {}
+        self.constants = {}
+
+    def add_child(self, child: 'Alpha'):
+        signature = get_signature(child.pattern)
+        if self.discriminate:
+            for position, term in enumerate(child.pattern.terms):
+                if not is_variable(term):
+                    positions = self.positions.setdefault(signature, [])
+                    if position not in positions:
+                        positions.append(position)
+                    self.constants.setdefault((*signature, position, term), []).append(child)
+                    return
+
+        self.children.setdefault(signature, []).append(child)
+
+    def get_children(self, ground: Literal) -> Iterator['Alpha']:
+        signature = get_signature(ground)
+        yield from self.children.get(signature, ())
+        for position in self.positions.get(signature, ()):
+            yield from self.constants.get((*signature, position, ground.terms[position]), ())
 
     def notify(self, ground: Literal):
-        for child in self.children:
+        for child in self.get_children(ground):
             child.notify(ground, {}, self)
 
+    def retract(self, ground: Literal):
+        for child in self.get_children(ground):
+            child.retract(ground, {}, self)
+
+    def get_alphas(self) -> List['Alpha']:
+        return [*(a for c in self.children.values() for a in c), *(a for c in self.constants.values() for a in c)]
+
+    def get_statistics(self) -> Dict[str, int]:
+        statistics, nodes = {}, self.get_alphas()
+        while nodes:
+            node = nodes.pop()
+            if node.name not in statistics:
+                statistics[node.name] = len(node)
+                nodes.extend(getattr(node, 'children', ()))
+
+        return statistics
+
 
 class Alpha:
     def __init__(self, pattern: 'Literal', parent: Root):
         self.parent = parent
         self.pattern = pattern
         self.name = repr(pattern)
-        self.memory = []
+        self.variables = tuple(dict.fromkeys(t for t in pattern.terms if is_variable(t)))
+        self.memory = {}
         self.children = set()
-        parent.children.add(self)
+        parent.add_child(self)
+
+    def __len__(self) -> int:
+        return len(self.memory)
 
     def notify(self, ground: Literal, substitution: Substitution, parent: Root):
-        substitution = self.pattern.unify(ground)
-        if substitution is not None:
-            payload = ([ground], substitution)
-            if payload not in self.memory:
-                self.memory.append(payload)
+        if ground not in self.memory:
+            substitution = self.pattern.unify(ground)
+            if substitution is not None:
+                token = (ground,)
+                self.memory[ground] = substitution
                 for child in self.children:
-                    child.notify([ground], substitution, self)
+                    child.notify(token, substitution, self)
+
+    def retract(self, ground: Literal, substitution: Substitution, parent: Root):
+        if ground in self.memory:
+            substitution = self.memory.pop(ground)
+            token = (ground,)
+            for child in self.children:
+                child.retract(token, substitution, self)
 
 
-Node = Union[Alpha, 'Beta']
+class Scheduler:
+    # Worklist of facts waiting to be propagated from the root, FIFO unless a priority is given (lowest first).
+    # Every assertion or derivation of a fact counts as one unit of support for it.
+    def __init__(self, root: Root, priority: Optional[Callable[[Literal], float]] = None):
+        self.root = root
+        self.priority = priority
+        self._queue = deque() if priority is None else []
+        self._counter = count()
+        self._withdrawn = []
+        self.facts = {}
+        self.support = {}
+        self.processed = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def push(self, literal: Literal):
+        self.support[literal] = self.support.get(literal, 0) + 1
+        self.restore(literal)
+
+    def restore(self, literal: Literal):
+        if literal in self.facts:
+            return
+
+        self.facts[literal] = None
+        if self.priority is None:
+            self._queue.append(literal)
+        else:
+            heappush(self._queue, (self.priority(literal), next(self._counter), literal))
+
+    def withdraw(self, literal: Literal):
+        self.support[literal] -= 1
+        if not self.support[literal]:
+            del self.support[literal]
+        self._withdrawn.append(literal)
+
+    def extend(self, literals: Iterable[Literal]):
+        for literal in literals:
+            self.push(literal)
+
+    def pop(self) -> Literal:
+        if self.priority is None:
+            return self._queue.popleft()
+
+        return heappop(self._queue)[-1]
+
+    def run(self, limit: Optional[int] = None) -> int:
+        # Facts deleted while still waiting in the queue are skipped; negated literals may withdraw derivations.
+        processed = 0
+        while self._queue and processed != limit:
+            literal = self.pop()
+            if literal in self.facts:
+                self.root.notify(literal)
+                processed += 1
+                if self._withdrawn:
+                    self._purge()
+        self.processed += processed
+
+        return processed
+
+    def delete(self, literal: Literal) -> int:
+        self.withdraw(literal)
+        deleted = self._purge()
+        self.run()
+
+        return sum(1 for literal in deleted if literal not in self.facts)
+
+    def _purge(self) -> List[Literal]:
+        # Delete-and-rederive: first remove the withdrawn facts and everything derived through them, whatever
+        # their other support, then put back the removed facts that are still supported by what survived.
+        deleted = []
+        while self._withdrawn:
+            literal = self._withdrawn.pop()
+            if literal in self.facts:
+                del self.facts[literal]
+                deleted.append(literal)
+                self.root.retract(literal)
+
+        for literal in deleted:
+            if literal in self.support:
+                self.restore(literal)
+
+        return deleted
+
+
+class Unit:
+    # The prefix of a body before its first literal, holding the one empty token: bodies whose first literals are
+    # negated filter it, so that their heads hold until a fact matching one of those literals arrives.
+    def __init__(self):
+        self.name = 'true'
+        self.variables = ()
+        self.memory = {(): {}}
+        self.children = set()
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def start(self):
+        for child in self.children:
+            child.notify((), {}, self)
+
+
+Node = Union[Alpha, 'Beta', 'Negation', Unit]
 
 
 class Beta:
-    def __init__(self, parent_1: Node, parent_2: Alpha):
+    # Joins the tokens of a body prefix with those of the next alpha, whose variables are renamed into the prefix's.
+    def __init__(self, parent_1: Node, parent_2: Alpha, renaming: Optional[Dict[Variable, Variable]] = None):
         self.parent_1 = parent_1
         self.parent_2 = parent_2
-        self.name = '%s, %s' % (parent_1.name, parent_2.name)
-        self.memory = []
+        self.renaming = renaming or {v: v for v in parent_2.variables}
+        self.name = '%s, %s' % (parent_1.name, parent_2.pattern.substitute(self.renaming))
+        right = tuple(self.renaming[v] for v in parent_2.variables)
+        self.variables = tuple(dict.fromkeys((*parent_1.variables, *right)))
+        self.join = tuple(v for v in right if v in parent_1.variables)
+        self.left = {}
+        self.right = {}
+        self.memory = {}
         self.children = set()
         parent_1.children.add(self)
         parent_2.children.add(self)
 
-    def notify(self, ground: List[Literal], substitution: Substitution, parent: Node):
-        if parent is self.parent_1:
-            for ground_2, subs_2 in self.parent_2.memory:
-                self._notify(ground, substitution, ground_2, subs_2)
-        elif parent is self.parent_2:
-            for ground_1, subs_1 in self.parent_1.memory:
-                self._notify(ground_1, subs_1, ground, substitution)
+    def __len__(self) -> int:
+        return len(self.memory)
 
-    @staticmethod
-    def _unify(substitution_1: Substitution, substitution_2: Substitution) -> Optional[Substitution]:
-        for var in set(substitution_1).intersection(substitution_2):
-            if substitution_1[var] != substitution_2[var]:
-                return None
+    def notify(self, token: Token, substitution: Substitution, parent: Node):
+        if parent is self.parent_1:
+            key = tuple(substitution[v] for v in self.join)
+            self.left.setdefault(key, {})[token] = substitution
+            for token_2, substitution_2 in tuple(self.right.get(key, {}).items()):
+                self._notify(token, substitution, token_2, substitution_2)
+        if parent is self.parent_2:
+            substitution = {self.renaming[v]: t for v, t in substitution.items()}
+            key = tuple(substitution[v] for v in self.join)
+            self.right.setdefault(key, {})[token] = substitution
+            for token_1, substitution_1 in tuple(self.left.get(key, {}).items()):
+                self._notify(token_1, substitution_1, token, substitution)
+
+    def _notify(self, token_1: Token, substitution_1: Substitution, token_2: Token, substitution_2: Substitution):
+        token = (*token_1, *token_2)
+        if token not in self.memory:
+            substitution = {**substitution_1, **substitution_2}
+            self.memory[token] = substitution
+            for child in self.children:
+                child.notify(token, substitution, self)
+
+    def retract(self, token: Token, substitution: Substitution, parent: Node):
+        if parent is self.parent_1:
+            key = tuple(substitution[v] for v in self.join)
+            if self.left.get(key, {}).pop(token, None) is not None:
+                for token_2 in tuple(self.right.get(key, ())):
+                    self._retract((*token, *token_2))
+        if parent is self.parent_2:
+            substitution = {self.renaming[v]: t for v, t in substitution.items()}
+            key = tuple(substitution[v] for v in self.join)
+            if self.right.get(key, {}).pop(token, None) is not None:
+                for token_1 in tuple(self.left.get(key, ())):
+                    self._retract((*token_1, *token))
+
+    def _retract(self, token: Token):
+        if token in self.memory:
+            substitution = self.memory.pop(token)
+            for child in self.children:
+                child.retract(token, substitution, self)
+
+
+class Negation:
+    # Passes on the tokens of a body prefix for which the alpha of a negated literal holds no match.
+    def __init__(self, parent_1: Node, parent_2: Alpha, renaming: Optional[Dict[Variable, Variable]] = None):
+        self.parent_1 = parent_1
+        self.parent_2 = parent_2
+        self.renaming = renaming or {v: v for v in parent_2.variables}
+        self.name = '%s, ~%s' % (parent_1.name, parent_2.pattern.substitute(self.renaming))
+        self.variables = parent_1.variables
+        self.join = tuple(self.renaming[v] for v in parent_2.variables)
+        self.left = {}
+        self.right = {}
+        self.memory = {}
+        self.children = set()
+        parent_1.children.add(self)
+        parent_2.children.add(self)
 
-        return {**substitution_1, **substitution_2}
+    def __len__(self) -> int:
+        return len(self.memory)
 
-    def _notify(self, ground_1: List[Literal], substitution_1: Substitution,
-                ground_2: List['Literal'], substitution_2: Substitution):
-        subs = self._unify(substitution_1, substitution_2)
-        if subs is not None:
-            ground = [*ground_1, *ground_2]
-            payload = (ground, subs)
-            if payload not in self.memory:
-                self.memory.append(payload)
-                for child in self.children:
-                    child.notify(ground, subs, self)
+    def notify(self, token: Token, substitution: Substitution, parent: Node):
+        if parent is self.parent_1:
+            key = tuple(substitution[v] for v in self.join)
+            self.left.setdefault(key, {})[token] = substitution
+            if key not in self.right:
+                self._notify(token, substitution)
+        if parent is self.parent_2:
+            key = tuple(substitution[v] for v in self.parent_2.variables)
+            if key not in self.right:
+                for token_1 in tuple(self.left.get(key, ())):
+                    self._retract(token_1)
+            self.right.setdefault(key, set()).add(token)
+
+    def _notify(self, token: Token, substitution: Substitution):
+        if token not in self.memory:
+            self.memory[token] = substitution
+            for child in self.children:
+                child.notify(token, substitution, self)
+
+    def retract(self, token: Token, substitution: Substitution, parent: Node):
+        if parent is self.parent_1:
+            key = tuple(substitution[v] for v in self.join)
+            if self.left.get(key, {}).pop(token, None) is not None:
+                self._retract(token)
+        if parent is self.parent_2:
+            key = tuple(substitution[v] for v in self.parent_2.variables)
+            tokens = self.right.get(key, set())
+            tokens.discard(token)
+            if not tokens and self.right.pop(key, None) is not None:
+                for token_1, substitution_1 in tuple(self.left.get(key, {}).items()):
+                    self._notify(token_1, substitution_1)
+
+    def _retract(self, token: Token):
+        if token in self.memory:
+            substitution = self.memory.pop(token)
+            for child in self.children:
+                child.retract(token, substitution, self)
 
 
 class Leaf:
-    def __init__(self, clause: Clause, parent: Node, root: Root, agenda: List[Clause]):
+    def __init__(self, clause: Clause, parent: Node, scheduler: Scheduler, agenda: Dict[Clause, None],
+                 renaming: Optional[Dict[Variable, Variable]] = None):
         self.parent = parent
         self.clause = clause
+        self.head = clause.head.substitute(renaming) if renaming else clause.head
         self.name = repr(clause)
-        self.memory = []
+        self.memory = {}
 
-        self.root = root
+        self.scheduler = scheduler
         self.agenda = agenda
         parent.children.add(self)
 
-    def notify(self, ground: List[Literal], substitution: Substitution, parent: Node):
-        payload = (ground, substitution)
-        if payload not in self.memory:
-            self.memory.append(payload)
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def notify(self, token: Token, substitution: Substitution, parent: Node):
+        if token not in self.memory:
+            self.memory[token] = substitution
+
+            literal = self.head.substitute(substitution)
+            self.agenda.setdefault(Clause(literal, token), None)
+
+            self.scheduler.push(literal)
+
+    def retract(self, token: Token, substitution: Substitution, parent: Node):
+        if token in self.memory:
+            del self.memory[token]
+
+            literal = self.head.substitute(substitution)
+            self.agenda.pop(Clause(literal, token), None)
+
+            self.scheduler.withdraw(literal)
+
+
+class Network:
+    # A Rete network compiled once from a set of rules; facts are pushed into it and retracted incrementally.
+    def __init__(self, rules: Iterable[Clause], planner: Optional[Planner] = None, discriminate: bool = True):
+        self.planner = planner
+        self.table = {}
+        self.agenda = {}
+        self.facts = set()
+        self.root = Root(discriminate)
+        self.unit = Unit()
+        rules, levels = list(rules), {}
+        if any(literal.negated for rule in rules for literal in rule.body):
+            # Facts are propagated stratum by stratum, so that little is derived before a negation withdraws it.
+            levels = {s: i for i, stratum in enumerate(get_strata(rules)) for c in stratum for s in c}
+        self.scheduler = Scheduler(self.root, (lambda l: levels.get(get_signature(l), 0)) if levels else None)
+        self.leaves = [self._add_rule(rule) for rule in rules]
+        self.unit.start()
+
+    def __len__(self) -> int:
+        return len(self.scheduler.facts)
+
+    def _add_rule(self, rule: Clause) -> Leaf:
+        # Body variables are renamed by first occurrence, so that patterns and prefixes of different rules
+        # that only differ by variable names share their nodes.
+        order = self.planner.plan(rule) if self.planner is not None else get_safe_order(rule)
+        body, renaming = canonicalize([rule.body[i] for i in order])
+        beta = None
+        for lit in body:
+            (pattern,), local = canonicalize([Literal(lit.atom)])
+            name = repr(pattern)
+            alpha = self.table.get(name)
+            if alpha is None:
+                alpha = self.table[name] = Alpha(pattern, self.root)
+            if lit.negated and beta is None:
+                beta = self.unit
+            if beta is None:
+                beta = alpha
+            else:
+                node = Negation if lit.negated else Beta
+                name = '%s, %s' % (beta.name, lit)
+                shared = self.table.get(name)
+                if shared is None:
+                    shared = self.table[name] = node(beta, alpha, {v: k for k, v in local.items()})
+                beta = shared
+
+        return Leaf(rule, beta, self.scheduler, self.agenda, renaming)
+
+    def assert_facts(self, literals: Iterable[Literal]) -> int:
+        for literal in literals:
+            if literal not in self.facts:
+                self.facts.add(literal)
+                self.agenda.setdefault(Clause(literal), None)
+                self.scheduler.push(literal)
+
+        return self.scheduler.run()
+
+    def retract(self, literal: Literal) -> int:
+        if literal not in self.facts:
+            return 0
+
+        self.facts.remove(literal)
+        self.agenda.pop(Clause(literal), None)
 
-            literal = self.clause.head.substitute(substitution)
-            clause = Clause(literal, (*ground,))
-            if clause not in self.agenda:
-                self.agenda.append(clause)
+        return self.scheduler.delete(literal)
+
+    def get_world(self) -> List[Literal]:
+        return list(self.scheduler.facts)
 
-            self.root.notify(literal)
+    def get_statistics(self) -> Dict[str, int]:
+        return self.root.get_statistics()
 
 
-def cover(examples: List[Example], literal: Literal) -> int:
-    return sum(1 for e in examples if e.is_covered(literal))
+Row = Tuple[Term, ...]
 
 
-def max_gain(examples: List[Example], literal: Literal) -> float:
-    return cover(examples, literal) * information(examples)
+class Relation:
+    # The rows of one predicate, with a hash index for every combination of bound positions looked up so far.
+    def __init__(self, rows: Iterable[Row] = ()):
+        self.rows = set()
+        self.indexes = {}
+        for row in rows:
+            self.add(row)
 
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Row]:
+        return iter(self.rows)
+
+    def __contains__(self, row: Row) -> bool:
+        return row in self.rows
+
+    def add(self, row: Row) -> bool:
+        if row in self.rows:
+            return False
+
+        self.rows.add(row)
+        for positions, index in self.indexes.items():
+            index.setdefault(tuple(row[p] for p in positions), []).append(row)
+
+        return True
+
+    def lookup(self, positions: Tuple[int, ...], values: Row) -> Iterable[Row]:
+        if not positions:
+            return self.rows
+
+        index = self.indexes.get(positions)
+        if index is None:
+            index = {}
+            for row in self.rows:
+                index.setdefault(tuple(row[p] for p in positions), []).append(row)
+            self.indexes[positions] = index
+
+        return index.get(values, ())
+
+
+class BinaryRelation:
+    # A binary relation over a small domain, stored as a boolean matrix with NumPy or else as integer bitset rows,
+    # so that joins and transitive closure work on whole rows at a time.
+    def __init__(self, rows: Iterable[Row] = (), domain: Optional[Iterable[Term]] = None, dense: Optional[bool] = None):
+        rows = list(rows)
+        self.domain = list(dict.fromkeys(domain if domain is not None else (t for r in rows for t in r)))
+        self.positions = {t: i for i, t in enumerate(self.domain)}
+        self.dense = numpy is not None if dense is None else dense
+        if self.dense and numpy is None:
+            raise ValueError('Dense binary relations need NumPy')
+
+        size = len(self.domain)
+        if self.dense:
+            self.matrix = numpy.zeros((size, size), dtype=bool)
+            if rows:
+                indexes = numpy.array([(self.positions[x], self.positions[y]) for x, y in rows])
+                self.matrix[indexes[:, 0], indexes[:, 1]] = True
+        else:
+            self.bits = [0] * size
+            for x, y in rows:
+                self.bits[self.positions[x]] |= 1 << self.positions[y]
+
+    def __len__(self) -> int:
+        if self.dense:
+            return int(numpy.count_nonzero(self.matrix))
+
+        return sum(bin(b).count('1') for b in self.bits)
+
+    def __contains__(self, row: Row) -> bool:
+        x, y = self.positions.get(row[0]), self.positions.get(row[1])
+        if x is None or y is None:
+            return False
 
-def information(examples: List[Example]) -> float:
-    if not examples:
+        return bool(self.matrix[x, y]) if self.dense else bool(self.bits[x] >> y & 1)
+
+    def __iter__(self) -> Iterator[Row]:
+        domain = self.domain
+        if self.dense:
+            for x, y in zip(*(i.tolist() for i in numpy.nonzero(self.matrix))):
+                yield domain[x], domain[y]
+            return
+
+        for x, bits in enumerate(self.bits):
+            while bits:
+                low = bits & -bits
+                yield domain[x], domain[low.bit_length() - 1]
+                bits ^= low
+
+    def _copy(self, data) -> 'BinaryRelation':
+        relation = BinaryRelation(domain=self.domain, dense=self.dense)
+        if self.dense:
+            relation.matrix = data
+        else:
+            relation.bits = data
+
+        return relation
+
+    def compose(self, other: 'BinaryRelation') -> 'BinaryRelation':
+        # The join r(X, Z), s(Z, Y) projected on X and Y, over the same domain.
+        if self.domain != other.domain or self.dense != other.dense:
+            raise ValueError('Binary relations must share their domain and storage')
+
+        if self.dense:
+            return self._copy(self.matrix.astype(numpy.float32) @ other.matrix.astype(numpy.float32) > 0)
+
+        rows = []
+        for bits in self.bits:
+            row = 0
+            while bits:
+                low = bits & -bits
+                row |= other.bits[low.bit_length() - 1]
+                bits ^= low
+            rows.append(row)
+
+        return self._copy(rows)
+
+    def closure(self) -> 'BinaryRelation':
+        # Warshall's algorithm, one pivot at a time over all the rows reaching it (bit-packed with NumPy).
+        size = len(self.domain)
+        if self.dense:
+            packed = numpy.packbits(self.matrix, axis=1)
+            for k in range(size):
+                reaching = (packed[:, k >> 3] >> (7 - (k & 7)) & 1).astype(bool)
+                if reaching.any():
+                    packed[reaching] |= packed[k]
+            return self._copy(numpy.unpackbits(packed, axis=1, count=size).astype(bool))
+
+        rows = list(self.bits)
+        for k in range(size):
+            bit, row = 1 << k, rows[k]
+            if row:
+                for i in range(size):
+                    if rows[i] & bit:
+                        rows[i] |= row
+
+        return self._copy(rows)
+
+    def get_literals(self, functor: str) -> List[Literal]:
+        return [Literal(Atom(functor, row)) for row in self]
+
+
+class Step:
+    # How a body literal is matched once the variables of the literals before it are bound.
+    def __init__(self, literal: Literal, bound: Iterable[Variable]):
+        self.literal = literal
+        self.signature = get_dependency(literal)
+        self.negated = literal.negated
+        self.positions, self.values, self.free = (), (), ()
+        bound = set(bound)
+        for position, term in enumerate(literal.terms):
+            if not is_variable(term) or term in bound:
+                self.positions += (position,)
+                self.values += (term,)
+            else:
+                self.free += ((position, term),)
+
+    def match(self, relation: Relation, substitution: Substitution) -> Iterator[Substitution]:
+        values = tuple(substitution[v] if is_variable(v) else v for v in self.values)
+        if self.negated:
+            if values not in relation:
+                yield substitution
+            return
+
+        for row in relation.lookup(self.positions, values):
+            match = dict(substitution)
+            for position, variable in self.free:
+                if match.setdefault(variable, row[position]) != row[position]:
+                    break
+            else:
+                yield match
+
+
+class Plan:
+    # A rule compiled for set-at-a-time evaluation.
+    def __init__(self, clause: Clause):
+        self.clause = clause
+        self.signature = get_signature(clause.head)
+        self.steps, bound = [], []
+        for i in get_safe_order(clause):
+            literal = clause.body[i]
+            self.steps.append(Step(literal, bound))
+            bound.extend(t for t in literal.terms if is_variable(t))
+        if any(is_variable(t) and t not in bound for t in clause.head.terms):
+            raise ValueError('Bottom-up evaluation needs range-restricted clauses: %s' % clause)
+
+    def evaluate(self, relations: List[Relation]) -> Iterator[Row]:
+        substitutions = [{}]
+        for step, relation in zip(self.steps, relations):
+            substitutions = [m for s in substitutions for m in step.match(relation, s)]
+            if not substitutions:
+                return
+
+        terms = self.clause.head.terms
+        for substitution in substitutions:
+            yield tuple(substitution[t] if is_variable(t) else t for t in terms)
+
+
+def get_components(clauses: Iterable[Clause]) -> List[List[Signature]]:
+    # Strongly connected components of the predicate dependency graph, each listed after those it depends on.
+    graph = {}
+    for clause in clauses:
+        edges = graph.setdefault(get_signature(clause.head), set())
+        for literal in clause.body:
+            edges.add(get_dependency(literal))
+            graph.setdefault(get_dependency(literal), set())
+
+    index, lowlink, components = {}, {}, []
+    for start in graph:
+        if start not in index:
+            _connect(start, graph, index, lowlink, components)
+
+    return components
+
+
+def _connect(start: Signature, graph: Dict[Signature, Set[Signature]], index: Dict[Signature, int],
+             lowlink: Dict[Signature, int], components: List[List[Signature]]):
+    # Tarjan's algorithm from 'start', with the nodes being visited and their edges left in 'work', and the nodes
+    # not yet in a component in 'stack', ordered as a stack.
+    work, stack = [(start, iter(graph[start]))], {start: None}
+    index[start] = lowlink[start] = len(index)
+    while work:
+        node, edges = work[-1]
+        for successor in edges:
+            if successor not in index:
+                index[successor] = lowlink[successor] = len(index)
+                stack[successor] = None
+                work.append((successor, iter(graph[successor])))
+                break
+            if successor in stack:
+                lowlink[node] = min(lowlink[node], index[successor])
+        else:
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = [stack.popitem()[0]]
+                while component[-1] != node:
+                    component.append(stack.popitem()[0])
+                components.append(component)
+
+
+def get_strata(clauses: Iterable[Clause]) -> List[List[List[Signature]]]:
+    # Components grouped by the longest chain of dependencies below them: a stratum only depends on earlier ones,
+    # so its components can be saturated independently. Negation must not occur within a component.
+    clauses = list(clauses)
+    components = get_components(clauses)
+    members = {s: i for i, component in enumerate(components) for s in component}
+    dependencies = {}
+    for clause in clauses:
+        head = members[get_signature(clause.head)]
+        for literal in clause.body:
+            dependency = members[get_dependency(literal)]
+            if dependency == head and literal.negated:
+                raise ValueError('Negation through recursion is not stratified: %s' % clause)
+            dependencies.setdefault(head, set()).add(dependency)
+
+    levels, strata = [], []
+    for i, component in enumerate(components):
+        level = max((levels[j] + 1 for j in dependencies.get(i, ()) if j != i), default=0)
+        levels.append(level)
+        if level == len(strata):
+            strata.append([])
+        strata[level].append(component)
+
+    return strata
+
+
+def get_closure(clauses: Iterable[Clause]) -> Optional[Signature]:
+    # The signature of 'e' if the clauses only define 'p' as its transitive closure, i.e. p(X, Y) :- e(X, Y)
+    # and any of p(X, Y) :- p(X, Z), e(Z, Y) or p(X, Y) :- e(X, Z), p(Z, Y) or p(X, Y) :- p(X, Z), p(Z, Y).
+    clauses = [c for c in clauses if not c.is_fact()]
+    bases = [c.body[0] for c in clauses if len(c.body) == 1]
+    if len(bases) != 1 or len(clauses) < 2 or bases[0].get_arity() != 2 or bases[0].negated:
+        return None
+
+    def link(functor: str, x: Variable, y: Variable) -> Literal:
+        return Literal(Atom(functor, (x, y)))
+
+    p, e = clauses[0].head.functor, bases[0].functor
+    shapes = {
+        Clause(link(p, '_0', '_1'), (link(e, '_0', '_1'),)),
+        Clause(link(p, '_0', '_1'), (link(p, '_0', '_2'), link(e, '_2', '_1'))),
+        Clause(link(p, '_0', '_1'), (link(e, '_0', '_2'), link(p, '_2', '_1'))),
+        Clause(link(p, '_0', '_1'), (link(p, '_0', '_2'), link(p, '_2', '_1'))),
+    }
+    for clause in clauses:
+        (head, *body), _ = canonicalize([clause.head, *clause.body])
+        if Clause(head, tuple(body)) not in shapes:
+            return None
+
+    return get_signature(bases[0]) if p != e else None
+
+
+class Evaluator:
+    # Semi-naive bottom-up evaluation: the components of the dependency graph are saturated stratum by stratum,
+    # and within a recursive component each round only joins against the rows derived by the previous one.
+    # Negated literals are anti-joins against the complete relations of earlier strata.
+    # With 'matrices', components computing the transitive closure of a binary relation use a BinaryRelation,
+    # unless they have facts of their own. The given 'relations' are only read, unless the clauses define them.
+    def __init__(self, clauses: Iterable[Clause], matrices: bool = False,
+                 relations: Optional[Dict[Signature, Relation]] = None):
+        clauses = list(clauses)
+        self.relations = dict(relations or {})
+        self.plans = {}
+        self.strata = get_strata(clauses)
+        self.matrices = matrices
+        self.rounds = 0
+        for stratum in self.strata:
+            for component in stratum:
+                for signature in component:
+                    self.get_relation(signature)
+        for clause in clauses:
+            if not clause.is_fact():
+                plan = Plan(clause)
+                self.plans.setdefault(plan.signature, []).append(plan)
+            elif clause.is_ground():
+                self.get_relation(get_signature(clause.head)).add(tuple(clause.head.terms))
+            else:
+                raise ValueError('Bottom-up evaluation needs ground facts: %s' % clause)
+
+    def get_relation(self, signature: Signature) -> Relation:
+        relation = self.relations.get(signature)
+        if relation is None:
+            relation = self.relations[signature] = Relation()
+
+        return relation
+
+    def run(self) -> 'Evaluator':
+        for stratum in self.strata:
+            self.rounds += sum(map(self._saturate, stratum))
+
+        return self
+
+    def _saturate(self, component: List[Signature]) -> int:
+        plans = [p for s in component for p in self.plans.get(s, ())]
+        base = get_closure(p.clause for p in plans) if self.matrices and len(component) == 1 else None
+        relation = self.get_relation(component[0])
+        if base is not None and not relation:
+            for row in BinaryRelation(self.get_relation(base)).closure():
+                relation.add(row)
+            return 0
+
+        delta = self._fire(plans, {})
+        recursive = [p for p in plans if any(s.signature in component for s in p.steps)]
+        rounds = 0
+        while recursive and any(delta.values()):
+            rounds += 1
+            delta = self._fire(recursive, delta)
+
+        return rounds
+
+    def _fire(self, plans: List[Plan], delta: Dict[Signature, Relation]) -> Dict[Signature, Relation]:
+        derived = {}
+        for plan in plans:
+            sources = [self.get_relation(s.signature) for s in plan.steps]
+            if not delta:
+                variants = [sources]
+            else:
+                variants = [
+                    [*sources[:i], delta[s.signature], *sources[i + 1:]]
+                    for i, s in enumerate(plan.steps) if s.signature in delta
+                ]
+            relation = self.get_relation(plan.signature)
+            for relations in variants:
+                for row in plan.evaluate(relations):
+                    if row not in relation:
+                        derived.setdefault(plan.signature, set()).add(row)
+
+        for signature, rows in derived.items():
+            relation = self.get_relation(signature)
+            for row in rows:
+                relation.add(row)
+
+        return {s: Relation(rows) for s, rows in derived.items()}
+
+    def get_world(self) -> List[Literal]:
+        return [
+            Literal(Atom(functor, row), negated)
+            for (negated, functor, _), relation in self.relations.items() for row in relation
+        ]
+
+
+def _adorned(literal: Literal, adornment: Adornment) -> Literal:
+    return Literal(Atom('%s@%s' % (literal.functor, adornment), literal.terms), literal.negated)
+
+
+def _magic(literal: Literal, adornment: Adornment) -> Literal:
+    functor = 'magic@%s%s@%s' % ('~' if literal.negated else '', literal.functor, adornment)
+    return Literal(Atom(functor, tuple(t for t, a in zip(literal.terms, adornment) if a == 'b')))
+
+
+def magic_sets(clauses: Iterable[Clause], query: Literal) -> List[Clause]:
+    # Rewrites the clauses for the binding pattern of 'query' (left-to-right sideways information passing):
+    # derived predicates are adorned with their bound/free arguments and guarded by magic predicates, which
+    # collect the bindings each call is actually made with. Neither the seed fact for 'query' itself nor the facts
+    # of the predicates no rule defines are included. Negated literals keep the original clauses of their
+    # complement, which they need complete.
+    clauses = list(clauses)
+    derived = {get_signature(c.head) for c in clauses if not c.is_fact()}
+    result = []
+
+    adornment = get_adornment(query)
+    pending, seen, complete = [(get_signature(query), adornment)], {(get_signature(query), adornment)}, set()
+    while pending:
+        signature, adornment = pending.pop()
+        for clause in (c for c in clauses if get_signature(c.head) == signature):
+            rules, calls, negated = _rewrite(clause, adornment, derived)
+            result.extend(rules)
+            complete.update(negated)
+            pending.extend(c for c in calls if c not in seen)
+            seen.update(calls)
+
+    return [*result, *_get_complete(clauses, complete & derived, derived)]
+
+
+def _rewrite(clause: Clause, adornment: Adornment,
+             derived: Set[Signature]) -> Tuple[List[Clause], List[Tuple[Signature, Adornment]], List[Signature]]:
+    # The adorned clause and the magic rules of its derived literals, the calls they make and the negated predicates.
+    bound = {t for t, a in zip(clause.head.terms, adornment) if a == 'b' and is_variable(t)}
+    body, rules, calls, negated = [_magic(clause.head, adornment)], [], [], []
+    for literal in (clause.body[i] for i in get_safe_order(clause)):
+        if literal.negated:
+            negated.append(get_dependency(literal))
+        elif get_signature(literal) in derived:
+            inner = get_adornment(literal, bound)
+            rules.append(Clause(_magic(literal, inner), tuple(body)))
+            if (get_signature(literal), inner) not in calls:
+                calls.append((get_signature(literal), inner))
+            literal = _adorned(literal, inner)
+        body.append(literal)
+        bound.update(t for t in literal.terms if is_variable(t))
+    rules.append(Clause(_adorned(clause.head, adornment), tuple(body)))
+
+    return rules, calls, negated
+
+
+def _get_complete(clauses: List[Clause], complete: Set[Signature], derived: Set[Signature]) -> List[Clause]:
+    # The original clauses of the 'complete' predicates, and of the derived predicates they depend on.
+    result, pending = [], list(complete)
+    while pending:
+        signature = pending.pop()
+        for clause in (c for c in clauses if get_signature(c.head) == signature):
+            result.append(clause)
+            for dependency in map(get_dependency, clause.body):
+                if dependency in derived and dependency not in complete:
+                    complete.add(dependency)
+                    pending.append(dependency)
+
+    return result
+
+
+def cover(training_set: Training, literal: Literal, ground: Ground) -> int:
+    return ground.cover(training_set, literal)
+
+
+def max_gain(training_set: Training, literal: Literal, ground: Ground) -> float:
+    # What the gain would be if the literal kept all the positive assignments it covers and no negative one.
+    return cover(training_set, literal, ground) * information(training_set)
+
+
+def gain(training_set: Training, literal: Literal, ground: Ground) -> float:
+    count, size, positives = ground.get_counts(training_set, literal)
+    if not count:
+        return -inf
+
+    return count * (information(training_set) - _information(positives, size))
+
+
+def _set_ground(ground: Ground):
+    global _ground
+    _ground = ground
+
+
+def _score(literals: Iterable[Literal], training_set: Training, ground: Optional[Ground] = None,
+           hopeless: Optional[Dict[Signature, List[Literal]]] = None, offset: float = 0.0,
+           bests: Optional[List[float]] = None, totals: Optional[Dict[FrozenSet[Literal], float]] = None,
+           body: Tuple[Literal, ...] = ()) -> List[Tuple[Literal, float]]:
+    # Gains of the literals in order, skipping (as -inf) those whose bound plus 'offset' is below the least of the
+    # 'bests' heap of gains so far (plus their offsets). Those that are positive with distinct new variables are
+    # recorded in 'hopeless', as are all their specializations. With 'totals', the best total so far of each body
+    # extended by a literal, the heap keeps one total per body, so that its least stays a lower bound on the
+    # 'width'-th best body and pruning stays admissible when a body is reached in several orders.
+    ground = _ground if ground is None else ground
+    bests = [-inf] if bests is None else bests
+    scores = []
+    for literal in literals:
+        if offset + max_gain(training_set, literal, ground) < bests[0]:
+            scores.append((literal, -inf))
+            variables = [t for t in literal.terms if is_variable(t)]
+            if hopeless is not None and not literal.negated and len(set(variables)) == len(variables):
+                hopeless.setdefault(get_signature(literal), []).append(literal)
+        else:
+            scores.append((literal, gain(training_set, literal, ground)))
+            if totals is None:
+                heappushpop(bests, offset + scores[-1][1])
+            else:
+                _push(bests, totals, frozenset((*body, literal)), offset + scores[-1][1])
+
+    return scores
+
+
+def _push(bests: List[float], totals: Dict[FrozenSet[Literal], float], key: FrozenSet[Literal], total: float):
+    previous = totals.get(key, -inf)
+    if total <= previous:
+        return
+
+    totals[key] = total
+    if previous != -inf and previous in bests:
+        bests[bests.index(previous)] = total
+        heapify(bests)
+    else:
+        heappushpop(bests, total)
+
+
+def information(examples: Training) -> float:
+    return _information(examples.positives, examples.size)
+
+
+def _information(pos: int, size: float) -> float:
+    if not size:
         return -inf
 
-    pos = sum(1 for e in examples if e.positive)
     if pos == 0:
         return inf
 
-    return -log(pos / len(examples))  # / log(2)
+    return -log(pos / size)  # / log(2)
 
 
 def parenthood():
@@ -671,7 +2783,7 @@ def parenthood():
     print()
 
 
-def connectedness():
+def connectedness(workers: Optional[int] = None, arrays: bool = False, width: int = 1):
     program = Program((
         Clause(Literal(Atom('edge', (0, 1)))),
         Clause(Literal(Atom('edge', (0, 3)))),
@@ -687,14 +2799,10 @@ def connectedness():
     print(program)
     print()
 
-    examples = []
-    for x in range(9):
-        for y in range(9):
-            fact = Literal(Atom('edge', (x, y)))
-            positive = Clause(fact) in program.clauses
-            examples.append(Example((fact,), positive))
+    paths = BinaryRelation((tuple(f.head.terms) for f in program.get_facts()), range(9)).closure()
+    examples = [Example(Literal(Atom('path', (x, y))), (x, y) in paths) for x in range(9) for y in range(9)]
     target = Literal(Atom('path', ('X', 'Y')))
-    result = program.foil(examples, target)
+    result = program.foil(target, examples, workers, arrays=arrays, width=width)
     for clause in result:
         print(clause)
 
@@ -708,6 +2816,153 @@ def connectedness():
     # ))
 
 
+def benchmark_indexing(size: int = 100000, queries: int = 50):
+    rnd = Random(0)
+    nodes = size // 4
+    clauses = [Clause(Literal(Atom('edge', (rnd.randrange(nodes), rnd.randrange(nodes))))) for _ in range(size // 2)]
+    for i in range(size // 4):
+        clauses.append(Clause(Literal(Atom('father', ('f%d' % (i // 2), 'c%d' % i)))))
+        clauses.append(Clause(Literal(Atom('mother', ('m%d' % (i // 2), 'c%d' % i)))))
+    clauses.append(Clause(Literal(Atom('parent', ('X', 'Y'))), (Literal(Atom('father', ('X', 'Y'))),)))
+    clauses.append(Clause(Literal(Atom('parent', ('X', 'Y'))), (Literal(Atom('mother', ('X', 'Y'))),)))
+
+    goals = []
+    for _ in range(queries):
+        goals.append(Literal(Atom('edge', (rnd.randrange(nodes), rnd.randrange(nodes)))))
+        goals.append(clauses[rnd.randrange(size // 2)].head)
+        i = rnd.randrange(size // 4)
+        goals.append(Literal(Atom('parent', ('%s%d' % (rnd.choice('fm'), i // 2), 'c%d' % i))))
+    print('%d clauses, %d queries' % (len(clauses), len(goals)))
+
+    for indexes in [(), (0,), (0, 1)]:
+        start = perf_counter()
+        program = Program(tuple(clauses), indexes)
+        built = perf_counter()
+        proved = sum(1 for g in goals if program.resolve(g))
+        done = perf_counter()
+        print('indexes=%-7s build: %8.3fs  resolve: %8.3fs  (%d proved)' % (
+            indexes, built - start, done - built, proved,
+        ))
+
+
+def reachability(size: int = 200):
+    edges = [Clause(Literal(Atom('edge', (i, i + 1)))) for i in range(size)]
+    edges.append(Clause(Literal(Atom('edge', (size, 0)))))
+    program = Program((
+        Clause(Literal(Atom('path', ('X', 'Y'))), (
+            Literal(Atom('path', ('X', 'Z'))),
+            Literal(Atom('edge', ('Z', 'Y'))),
+        )),
+        Clause(Literal(Atom('path', ('X', 'Y'))), (Literal(Atom('edge', ('X', 'Y'))),)),
+        *edges,
+    ))
+
+    start = perf_counter()
+    answers = program.get_answers(Literal(Atom('path', (0, 'Y'))))
+    print('path(0, Y): %d answers in %.3fs' % (len(answers), perf_counter() - start))
+
+    start = perf_counter()
+    derivation = program.resolve(Literal(Atom('path', (size // 2, size // 4))), tabled=True)
+    print('path(%d, %d): %d steps in %.3fs' % (size // 2, size // 4, len(derivation), perf_counter() - start))
+
+
+def benchmark_bottom_up(size: int = 300, degree: float = 1.5):
+    rnd = Random(0)
+    program = Program((
+        Clause(Literal(Atom('path', ('X', 'Y'))), (Literal(Atom('edge', ('X', 'Y'))),)),
+        Clause(Literal(Atom('path', ('X', 'Y'))), (
+            Literal(Atom('path', ('X', 'Z'))),
+            Literal(Atom('edge', ('Z', 'Y'))),
+        )),
+        *(Clause(Literal(Atom('edge', (rnd.randrange(size), rnd.randrange(size))))) for _ in range(int(size * degree))),
+    ))
+
+    start = perf_counter()
+    world = program.get_world()
+    middle = perf_counter()
+    model = program.evaluate()
+    end = perf_counter()
+    print('%d facts  get_world: %.3fs  evaluate: %.3fs  same: %s' % (
+        len(world), middle - start, end - middle, set(world) == set(model),
+    ))
+
+
+def benchmark_closure(size: int = 1000, degree: float = 1.5):
+    rnd = Random(0)
+    edges = [
+        Clause(Literal(Atom('edge', (rnd.randrange(size), rnd.randrange(size))))) for _ in range(int(size * degree))
+    ]
+    program = Program((
+        Clause(Literal(Atom('path', ('X', 'Y'))), (Literal(Atom('edge', ('X', 'Y'))),)),
+        Clause(Literal(Atom('path', ('X', 'Y'))), (
+            Literal(Atom('path', ('X', 'Z'))),
+            Literal(Atom('edge', ('Z', 'Y'))),
+        )),
+        *edges,
+    ))
+
+    start = perf_counter()
+    model = program.evaluate()
+    middle = perf_counter()
+    matrices = program.evaluate(matrices=True)
+    end = perf_counter()
+    bits = BinaryRelation((tuple(e.head.terms) for e in edges), dense=False).closure()
+    print('%d facts  evaluate: %.3fs  matrices: %.3fs  bitsets: %.3fs  same: %s' % (
+        len(model), middle - start, end - middle, perf_counter() - end,
+        set(model) == set(matrices) == {*bits.get_literals('path'), *(e.head for e in edges)},
+    ))
+
+
+def benchmark_parsing(size: int = 200000):
+    rnd = Random(0)
+    program = Program((
+        Clause(Literal(Atom('path', ('X', 'Y'))), (Literal(Atom('edge', ('X', 'Y'))),)),
+        Clause(Literal(Atom('path', ('X', 'Y'))), (
+            Literal(Atom('path', ('X', 'Z'))),
+            Literal(Atom('edge', ('Z', 'Y'))),
+        )),
+        *(Clause(Literal(Atom('edge', ('n%d' % rnd.randrange(size), rnd.randrange(size))))) for _ in range(size)),
+    ))
+
+    buffer = StringIO()
+    start = perf_counter()
+    write_clauses(program.clauses, buffer)
+    middle = perf_counter()
+    buffer.seek(0)
+    clauses = list(read_clauses(buffer))
+    end = perf_counter()
+    print('%d clauses  %d characters  write: %.3fs  read: %.3fs  same: %s' % (
+        len(clauses), buffer.tell(), middle - start, end - middle, clauses == program.clauses,
+    ))
+
+
+def engagement(size: int = 200):
+    rnd = Random(0)
+    program = Program((
+        Clause(Literal(Atom('engaged', ('E',))), (Literal(Atom('engaged_with', ('E', 'I'))),)),
+        Clause(Literal(Atom('occupied', ('L',))), (Literal(Atom('investigator_at', ('I', 'L'))),)),
+        Clause(Literal(Atom('lurking', ('E', 'L'))), (
+            Literal(Atom('occupied', ('L',)), True),
+            Literal(Atom('enemy_at', ('E', 'L'))),
+            Literal(Atom('engaged', ('E',)), True),
+        )),
+        *(Clause(Literal(Atom('enemy_at', (e, rnd.randrange(size))))) for e in range(size)),
+        *(Clause(Literal(Atom('investigator_at', (i, rnd.randrange(size))))) for i in range(size // 2)),
+        *(Clause(Literal(Atom('engaged_with', (rnd.randrange(size), i)))) for i in range(size // 4)),
+    ))
+    query = Literal(Atom('lurking', ('E', 'L')))
+
+    start = perf_counter()
+    answers = {query.substitute(s) for s in program.solve(query)}
+    middle = perf_counter()
+    world = {l for l in program.get_world() if l.functor == 'lurking'}
+    end = perf_counter()
+    model = {l for l in program.evaluate() if l.functor == 'lurking'}
+    print('%d unengaged enemies at empty locations  solve: %.3fs  get_world: %.3fs  same: %s' % (
+        len(answers), middle - start, end - middle, answers == world == model == set(program.query(query)),
+    ))
+
+
 def abstract():
     program = Program((
         Clause(Literal(Atom('q', ('X', 'Y'))), (Literal(Atom('p', ('Y', 'X'))),)),
@@ -0,0 +1,487 @@
+import os
+import pickle
+import tempfile
+import unittest
+from copy import deepcopy
+from io import StringIO
+from math import inf, nan
+from random import Random
+from typing import Iterator
+from time import perf_counter
+from unittest import mock
+
+from assertpy import assert_that
+
+from arkham.other.tempo import ArrayTrainingSet, Atom, BinaryRelation, Clause, Example, Facts, Literal, Network, \
+    Program, Table, TrainingSet, World, get_components, get_strata, parse, read_clauses, write_clauses
+
+
+def lit(functor, *terms, negated=False):
+    return Literal(Atom(functor, terms), negated)
+
+
+def fact(functor, *terms):
+    return Clause(lit(functor, *terms))
+
+
+def stratified(seed, nodes=4):
+    # Transitive closure over random edges, with negation on top of it (at the start of some bodies too).
+    rnd = Random(seed)
+    return Program((
+        *(fact('edge', rnd.randrange(nodes), rnd.randrange(nodes)) for _ in range(6)),
+        *(fact('marked', rnd.randrange(nodes)) for _ in range(2)),
+        Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+        Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        Clause(lit('reaches', 'X'), (lit('path', 'X', 'Y'), lit('marked', 'Y', negated=True))),
+        Clause(lit('safe'), (lit('reaches', rnd.randrange(nodes), negated=True),)),
+        Clause(lit('kept', 'X'), (lit('safe', negated=True), lit('marked', 'X'))),
+    ))
+
+
+class TestTerms(unittest.TestCase):
+    def test_equal_terms_are_built_once(self):
+        clause = Clause(lit('p', 'X', 1), (lit('q', 'X', negated=True),))
+        assert_that(Clause(lit('p', 'X', 1), (lit('q', 'X', negated=True),))).is_same_as(clause)
+        assert_that(Atom('p', ['X', 1])).is_same_as(clause.head.atom)
+        assert_that(pickle.loads(pickle.dumps(clause))).is_same_as(clause)
+        assert_that(deepcopy(clause)).is_same_as(clause)
+        assert_that(hash(clause)).is_equal_to(hash(Clause(lit('p', 'X', 1), (lit('q', 'X', negated=True),))))
+
+    def test_terms_of_different_types_stay_apart(self):
+        atoms = {Atom('p', (1,)), Atom('p', (1.0,)), Atom('p', (True,)), Atom('p', ('1',))}
+        assert_that(atoms).is_length(4)
+        assert_that(Atom('p', (1,))).is_not_equal_to(Atom('p', (True,)))
+
+    def test_api_is_kept(self):
+        literal = lit('p', 'X', 'Y', negated=True)
+        assert_that(literal.functor).is_equal_to('p')
+        assert_that(literal.terms).is_equal_to(('X', 'Y'))
+        assert_that(literal.get_arity()).is_equal_to(2)
+        assert_that(literal.get_complement()).is_same_as(lit('p', 'X', 'Y'))
+        assert_that(literal.substitute({'X': 1, 'Y': 2})).is_same_as(lit('p', 1, 2, negated=True))
+        assert_that(literal.unify(lit('p', 1, 2, negated=True))).is_equal_to({'X': 1, 'Y': 2})
+        assert_that(lit('p', 'X', 'X').unify(lit('p', 1, 2))).is_none()
+        assert_that(repr(Clause(lit('p', 'X'), (literal,)))).is_equal_to('p(X) :- ~p(X, Y).')
+
+
+class TestEngines(unittest.TestCase):
+    def test_bottom_up_agrees_with_rete(self):
+        for seed in range(50):
+            program = stratified(seed)
+            world = set(program.get_world())
+            assert_that(set(program.evaluate())).is_equal_to(world)
+            assert_that(set(program.evaluate(matrices=True))).is_equal_to(world)
+
+    def test_closure_matrices_keep_own_facts(self):
+        program = Program((
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('path', 'X', 'Z'), lit('edge', 'Z', 'Y'))),
+            fact('path', 0, 1),
+            fact('edge', 1, 2),
+        ))
+        assert_that(set(program.evaluate(matrices=True))).contains(lit('path', 0, 2))
+        assert_that(set(program.evaluate(matrices=True))).is_equal_to(set(program.evaluate()))
+
+    def test_closure_matrices_need_recursion(self):
+        program = Program((Clause(lit('p', 'X', 'Y'), (lit('e', 'X', 'Y'),)), fact('e', 1, 2), fact('e', 2, 3)))
+        assert_that(set(program.evaluate(matrices=True))).is_equal_to(set(program.evaluate()))
+
+    def test_queries_agree_with_bottom_up(self):
+        for seed in range(50):
+            program = stratified(seed)
+            world = set(program.evaluate())
+            for query in (lit('safe'), lit('kept', 'X'), lit('reaches', 'X'), lit('path', 0, 'Y')):
+                expected = {f for f in world if f.functor == query.functor and query.unify(f) is not None}
+                assert_that(set(program.query(query))).is_equal_to(expected)
+                assert_that(set(program.get_answers(query))).is_equal_to(expected)
+                answers = {query.substitute(s) for s in program.solve(query, tabled=True)}
+                assert_that(answers).is_equal_to(expected)
+
+    def test_sld_agrees_with_tabling_without_cycles(self):
+        program = Program((
+            *(fact('edge', i, i + 1) for i in range(6)),
+            fact('edge', 2, 5),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        for x in range(7):
+            query = lit('path', x, 'Y')
+            answers = {query.substitute(s) for s in program.solve(query)}
+            assert_that(answers).is_equal_to(set(program.get_answers(query)))
+            for y in range(7):
+                ground = lit('path', x, y)
+                assert_that(program.resolve(ground) is None).is_equal_to(program.resolve(ground, tabled=True) is None)
+
+    def test_tabling_deep_recursion(self):
+        program = Program((
+            *(fact('edge', i, i + 1) for i in range(400)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        assert_that(program.get_answers(lit('path', 0, 'Y'))).is_length(400)
+        assert_that(program.resolve(lit('path', 0, 400), tabled=True)).is_length(800)
+        assert_that(program.resolve(lit('path', 0, 401), tabled=True)).is_none()
+
+    def test_tabling_non_linear_recursion(self):
+        rnd = Random(0)
+        programs = [Program((
+            *(fact('e', *e) for e in [(0, 3), (0, 1), (3, 0), (3, 3), (1, 3), (1, 1)]),
+            Clause(lit('a', 'X', 'Y'), (lit('e', 'X', 'Y'),)),
+            Clause(lit('a', 'X', 'Z'), (lit('a', 'Z', 'Y'), lit('a', 'Z', 'X'))),
+            Clause(lit('a', 'X', 'Y'), (lit('a', 'Y', 'Y'), lit('b', 'Y', 'X'))),
+        )), Program((
+            *(fact('e', rnd.randrange(40), rnd.randrange(40)) for _ in range(80)),
+            Clause(lit('a', 'X', 'Y'), (lit('e', 'X', 'Y'),)),
+            Clause(lit('a', 'X', 'Y'), (lit('a', 'X', 'Z'), lit('a', 'Z', 'Y'))),
+        ))]
+        start = perf_counter()
+        for program in programs:
+            world = set(program.evaluate())
+            for query in (lit('a', 'X', 'Y'), lit('a', 0, 'Y'), lit('a', 'X', 1)):
+                expected = {f for f in world if f.functor == 'a' and query.unify(f) is not None}
+                assert_that(set(program.get_answers(query))).is_equal_to(expected)
+        assert_that(perf_counter() - start).is_less_than(10)
+
+    def test_tabling_honours_timeout(self):
+        program = Program((
+            *(fact('edge', i, i + 1) for i in range(400)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        start = perf_counter()
+        answers = list(program.solve(lit('path', 0, 'Y'), timeout=0.1, tabled=True))
+        assert_that(perf_counter() - start).is_less_than(2)
+        assert_that(len(answers)).is_less_than(400)
+        assert_that(list(program.solve(lit('path', 0, 'Y'), timeout=0, tabled=True))).is_empty()
+        assert_that(program.get_answers(lit('path', 390, 'Y'))).is_length(10)
+
+    def test_sld_deep_proofs(self):
+        program = Program((
+            *(fact('edge', i, i + 1) for i in range(3000)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        derivation = program.resolve(lit('path', 0, 3000))
+        assert_that(derivation).is_length(6000)
+        assert_that(derivation[:3]).is_equal_to([
+            (3001, lit('path', 0, 3000), {'X': 0, 'Y': 3000}),
+            (0, lit('edge', 0, 1), {}),
+            (3001, lit('path', 1, 3000), {'X': 1, 'Y': 3000}),
+        ])
+        assert_that(derivation[-1]).is_equal_to((2999, lit('edge', 2999, 3000), {}))
+        assert_that(program.resolve(lit('path', 0, 3001))).is_none()
+        answers = program.solve(lit('path', 2990, 'Y'), limit=3)
+        assert_that(list(answers)).is_equal_to([{'Y': 2991}, {'Y': 2992}, {'Y': 2993}])
+
+    def test_negation_only_body(self):
+        program = Program((Clause(lit('safe'), (lit('threat', negated=True),)),))
+        assert_that(program.get_world()).is_equal_to([lit('safe')])
+
+        program.add_clause(fact('threat'))
+        assert_that(program.get_world()).is_equal_to([lit('threat')])
+
+        program.retract(lit('threat'))
+        assert_that(program.get_world()).is_equal_to([lit('safe')])
+
+    def test_unstratified_negation_is_rejected(self):
+        program = Program((Clause(lit('p'), (lit('p', negated=True),)),))
+        for engine in (
+                lambda: program.resolve(lit('p')),
+                lambda: list(program.solve(lit('p'))),
+                lambda: program.get_answers(lit('p')),
+                program.evaluate,
+                program.get_world,
+        ):
+            assert_that(engine).raises(ValueError).when_called_with()
+
+
+class TestRete(unittest.TestCase):
+    def test_retraction_agrees_with_recomputation(self):
+        for seed in range(20):
+            rnd, program = Random(seed), stratified(seed)
+            program.get_world()
+            for _ in range(10):
+                edge = lit('edge', rnd.randrange(4), rnd.randrange(4))
+                if rnd.random() < 0.5:
+                    program.retract(edge)
+                elif Clause(edge) not in program.clauses:
+                    program.add_clause(Clause(edge))
+                assert_that(set(program.get_world())).is_equal_to(set(Program(tuple(program.clauses)).evaluate()))
+
+    def test_equal_patterns_share_nodes(self):
+        network = Network((
+            Clause(lit('a', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('b', 'X', 'Y'), (lit('edge', 'X', 'Y'), lit('edge', 'Y', 'Z'))),
+            Clause(lit('c', 'X', 'Z'), (lit('edge', 'X', 'Y'), lit('edge', 'Y', 'Z'))),
+        ))
+        assert_that(network.root.get_alphas()).is_length(1)
+        assert_that(network.table).is_length(2)
+
+        network.assert_facts([lit('edge', 1, 2), lit('edge', 2, 3)])
+        assert_that(set(network.get_world())).contains(lit('b', 1, 2), lit('c', 1, 3))
+
+
+class TestProgram(unittest.TestCase):
+    def test_candidates_follow_indexed_arguments(self):
+        clauses = (fact('edge', 1, 2), fact('edge', 1, 3), fact('edge', 2, 3), fact('edge', 'X', 4), fact('node', 1))
+        program = Program(clauses, indexes=(0, 1))
+        assert_that(program.get_candidates(lit('edge', 1, 'Y'))).is_equal_to([0, 1, 3])
+        assert_that(program.get_candidates(lit('edge', 'X', 3))).is_equal_to([1, 2])
+        assert_that(program.get_candidates(lit('edge', 'X', 'Y'))).is_equal_to([0, 1, 2, 3])
+        assert_that(program.get_candidates(lit('edge', 5, 'Y'))).is_equal_to([3])
+        assert_that(program.get_candidates(lit('node', 'X', 'Y'))).is_empty()
+
+        program.add_clause(fact('edge', 1, 5))
+        assert_that(program.get_candidates(lit('edge', 1, 'Y'))).is_equal_to([0, 1, 3, 5])
+
+    def test_indexes_do_not_change_proofs(self):
+        rnd = Random(0)
+        clauses = (
+            *(fact('edge', rnd.randrange(20), rnd.randrange(20)) for _ in range(40)),
+            fact('edge', 'X', 'X'),
+            Clause(lit('two', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('edge', 'Z', 'Y'))),
+        )
+        programs = [Program(clauses, indexes) for indexes in [(), (0,), (0, 1)]]
+        for x in range(20):
+            for query in (lit('edge', x, (x * 7) % 20), lit('two', x, (x * 3) % 20)):
+                proofs = [program.resolve(query) for program in programs]
+                assert_that(proofs[1:]).is_equal_to([proofs[0]] * 2)
+
+    def test_retract_fact_with_variables(self):
+        program = Program((fact('p', 'X'), fact('p', 1)))
+        assert_that(program.retract(lit('p', 'X'))).is_true()
+        assert_that(program.clauses).is_equal_to([Clause(lit('p', 1))])
+        assert_that(program.resolve(lit('p', 2))).is_none()
+        assert_that(program.retract(lit('p', 'X'))).is_false()
+
+    def test_queries_follow_changes_to_facts(self):
+        program = Program((
+            Clause(lit('two', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('edge', 'Z', 'Y'))),
+            fact('edge', 1, 2),
+            fact('edge', 2, 3),
+        ))
+        assert_that(program.query(lit('two', 1, 'Y'))).is_equal_to([lit('two', 1, 3)])
+        assert_that(program.query(lit('two', 1, 'Y'))).is_equal_to([lit('two', 1, 3)])
+
+        program.add_clause(fact('edge', 2, 4))
+        assert_that(set(program.query(lit('two', 1, 'Y')))).is_equal_to({lit('two', 1, 3), lit('two', 1, 4)})
+
+        program.retract(lit('edge', 1, 2))
+        assert_that(program.query(lit('two', 1, 'Y'))).is_empty()
+
+
+class TestParser(unittest.TestCase):
+    def test_written_clauses_read_back(self):
+        clauses = [
+            Clause(lit('a b', 'True')),
+            Clause(lit('p', True, False, 'False', 'inf', 'nan', 'info', inf, -inf, 1e300, -2.5, -3, 'x y')),
+            Clause(lit('q', 'X', nan), (lit('r', 'X', -inf), lit('s', 'X', negated=True))),
+        ]
+        stream = StringIO()
+        write_clauses(clauses, stream)
+        read = list(read_clauses(StringIO(stream.getvalue())))
+        assert_that(read[:2]).is_equal_to(clauses[:2])
+        assert_that([type(t) for t in read[1].head.terms]).is_equal_to([type(t) for t in clauses[1].head.terms])
+        assert_that(repr(read[2])).is_equal_to(repr(clauses[2]))
+
+    def test_keywords_name_predicates(self):
+        assert_that(parse('inf. nan(1) :- inf.')).is_equal_to([
+            Clause(lit('inf')), Clause(lit('nan', 1), (lit('inf'),)),
+        ])
+
+
+class TestTable(unittest.TestCase):
+    def test_partitions_evict_least_recently_used(self):
+        table = Table(capacity=2)
+        table.put(lit('p', 1), 'a')
+        table.put(lit('p', 2), 'b')
+        table.put(lit('q', 1), 'c')
+        assert_that(table.get(lit('p', 1))).is_equal_to('a')
+        table.put(lit('p', 3), 'd')
+        assert_that(lit('p', 2) in table).is_false()
+        assert_that(table.get(lit('p', 2), 'missing')).is_equal_to('missing')
+        assert_that(table.get_statistics()).contains_entry({'size': 3}, {'hits': 1}, {'misses': 1}, {'evictions': 1})
+
+    def test_resolve_counts_its_own_lookups(self):
+        program = Program((
+            *(fact('edge', i, i + 1) for i in range(50)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        assert_that(program.resolve(lit('path', 0, 50))).is_length(100)
+        assert_that(program.resolve(lit('path', 0, 50))).is_length(100)
+        statistics = program.tabling.get_statistics()
+        assert_that(statistics).contains_entry({'hits': 1}, {'misses': 1})
+        assert_that(statistics['probe_misses']).is_greater_than(0)
+
+    def test_invalidate_drops_dependent_proofs(self):
+        program = Program((
+            fact('edge', 1, 2),
+            fact('red', 2),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('safe', 'X'), (lit('red', 'X'), lit('path', 1, 'X', negated=True))),
+        ))
+        for query in (lit('edge', 1, 2), lit('path', 1, 2), lit('safe', 2), lit('red', 2)):
+            program.resolve(query)
+            assert_that(query in program.tabling).is_true()
+
+        program.invalidate((False, 'edge', 2))
+        assert_that([q in program.tabling for q in (lit('edge', 1, 2), lit('path', 1, 2), lit('safe', 2))]).is_equal_to(
+            [False, False, False])
+        assert_that(lit('red', 2) in program.tabling).is_true()
+
+        program.invalidate()
+        assert_that(program.tabling).is_empty()
+
+
+class TestPlanner(unittest.TestCase):
+    def test_selective_literals_go_first(self):
+        program = Program((
+            *(fact('big', i, j) for i in range(10) for j in range(10)),
+            *(fact('edge', i, i + 1) for i in range(10)),
+            Clause(lit('two', 'X', 'Y'), (lit('big', 'Z', 'Y'), lit('edge', 'X', 'Z'))),
+        ))
+        assert_that(program.explain(lit('two', 1, 'Y')).splitlines()).is_equal_to([
+            'two(X, Y) :- big(Z, Y), edge(X, Z).  [bf]',
+            '  1. edge(X, Z)  (~1.0 rows)',
+            '  2. big(Z, Y)  (~10.0 rows)',
+        ])
+        assert_that(program.resolve(lit('two', 1, 5))).is_not_none()
+        assert_that(program.planner).is_length(1)
+
+    def test_recursive_literals_wait_for_their_bindings(self):
+        program = Program((
+            *(fact('edge', x, 100 + i) for x in (0, 1) for i in range(10)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Y'),)),
+            Clause(lit('path', 'X', 'Y'), (lit('edge', 'X', 'Z'), lit('path', 'Z', 'Y'))),
+        ))
+        assert_that(program.explain(lit('path', 0, 7))).contains('1. edge(X, Z)')
+        assert_that(program.resolve(lit('path', 0, 7))).is_none()
+
+        program.add_clause(fact('path', 10, 11))
+        start = perf_counter()
+        assert_that(list(program.solve(lit('path', 0, 5), timeout=3))).is_empty()
+        assert_that(perf_counter() - start).is_less_than(1)
+
+
+class TestStrata(unittest.TestCase):
+    def test_components_follow_dependencies(self):
+        components = get_components((
+            Clause(lit('c', 'X'), (lit('b', 'X'),)),
+            Clause(lit('b', 'X'), (lit('a', 'X'), lit('c', 'X'))),
+            Clause(lit('a', 'X'), (lit('e', 'X'),)),
+        ))
+        assert_that([sorted(c) for c in components]).is_equal_to([
+            [(False, 'e', 1)], [(False, 'a', 1)], [(False, 'b', 1), (False, 'c', 1)],
+        ])
+
+    def test_strata_reject_negation_through_recursion(self):
+        clauses = (Clause(lit('p', 'X'), (lit('e', 'X'), lit('q', 'X', negated=True))),
+                   Clause(lit('q', 'X'), (lit('p', 'X'),)))
+        assert_that(get_strata).raises(ValueError).when_called_with(clauses)
+
+
+class TestFoil(unittest.TestCase):
+    def setUp(self):
+        edges = [(0, 1), (0, 3), (1, 2), (3, 2), (3, 4), (4, 5), (4, 6), (6, 8), (7, 6), (7, 8)]
+        self.program = Program(tuple(fact('edge', *e) for e in edges))
+        paths = BinaryRelation(edges, range(9)).closure()
+        self.examples = [Example(lit('path', x, y), (x, y) in paths) for x in range(9) for y in range(9)]
+        self.target = lit('path', 'X', 'Y')
+
+    def test_learns_transitive_closure(self):
+        clauses = self.program.foil(self.target, self.examples)
+        assert_that(clauses).is_equal_to([
+            Clause(self.target, (lit('edge', 'X', 'Y'),)),
+            Clause(self.target, (lit('edge', 'X', 'V0'), lit('path', 'V0', 'Y'))),
+        ])
+
+    def test_arrays_and_workers_agree_with_lists(self):
+        clauses = self.program.foil(self.target, self.examples)
+        assert_that(self.program.foil(self.target, self.examples, arrays=True)).is_equal_to(clauses)
+        assert_that(self.program.foil(self.target, self.examples, workers=2)).is_equal_to(clauses)
+
+    def test_beam_learns_consistent_clauses(self):
+        clauses = self.program.foil(self.target, self.examples, width=3)
+        world = set(Program((*self.program.clauses, *clauses)).evaluate())
+        for example in self.examples:
+            assert_that(example.fact in world).is_equal_to(example.positive)
+
+    def test_pruning_keeps_the_beam(self):
+        for seed in range(10):
+            rnd = Random(seed)
+            edges = {(rnd.randrange(6), rnd.randrange(6)) for _ in range(8)}
+            program = Program((*(fact('edge', *e) for e in edges), *(fact('red', rnd.randrange(6)) for _ in range(2))))
+            paths = BinaryRelation(edges, range(6)).closure()
+            examples = [Example(lit('t', x, y), (x, y) in paths) for x in range(6) for y in range(6)]
+            clauses = program.foil(lit('t', 'X', 'Y'), examples, width=3)
+            with mock.patch('arkham.other.tempo.max_gain', return_value=inf):
+                assert_that(program.foil(lit('t', 'X', 'Y'), examples, width=3)).is_equal_to(clauses)
+
+    def test_inseparable_examples_stop_the_search(self):
+        program = Program((fact('q', 1), fact('q', 2), fact('r', 1, 2), fact('r', 2, 1)))
+        examples = [Example(lit('t', 1), True), Example(lit('t', 2), False)]
+        for width in (1, 3):
+            assert_that(program.foil).raises(ValueError).when_called_with(lit('t', 'X'), examples, width=width)
+
+    def test_candidate_literals_are_lazy_and_distinct(self):
+        literals = self.program.new_literals(self.target, ())
+        assert_that(literals).is_instance_of(Iterator)
+        literals = list(literals)
+        assert_that(literals).does_not_contain_duplicates()
+        for literal in literals:
+            new = [t for t in dict.fromkeys(literal.terms) if t not in ('X', 'Y')]
+            assert_that(new).is_equal_to(['V%d' % i for i in range(len(new))])
+        assert_that(literals).contains(lit('edge', 'X', 'V0'), lit('edge', 'V0', 'Y'), lit('path', 'Y', 'V0'))
+        assert_that(literals).does_not_contain(lit('path', 'X', 'Y'), lit('path', 'V0', 'Y'), lit('edge', 'V0', 'V1'))
+
+        hopeless = {(False, 'edge', 2): [lit('edge', 'X', 'V0')]}
+        literals = list(self.program.new_literals(self.target, (), hopeless))
+        assert_that(literals).does_not_contain(lit('edge', 'X', 'X'), lit('edge', 'X', 'Y'))
+        assert_that(literals).contains(lit('edge', 'Y', 'X'), lit('path', 'Y', 'V0'))
+
+    def test_declarations_restrict_candidate_literals(self):
+        program = Program((fact('edge', 1, 2), fact('color', 1, 'red')))
+        program.declare((False, 'edge', 2), '+-', ('node', 'node'))
+        program.declare((False, 'color', 2), types=('node', 'colour'))
+        literals = list(program.new_literals(lit('t', 'X'), (lit('color', 'X', 'V0'),)))
+        edges = [literal for literal in literals if literal.functor == 'edge']
+        assert_that(edges).is_equal_to([lit('edge', 'X', 'V1'), lit('edge', 'X', 'X')])
+        assert_that(literals).contains(lit('color', 'V1', 'V0')).does_not_contain(lit('color', 'V0', 'X'))
+
+    def test_examples_parse_their_repr(self):
+        for example in (Example(lit('p', 1, 'a b', -2.5), True), Example(lit('q', 'x', negated=True), False)):
+            assert_that(Example.parse(repr(example))).is_equal_to(example)
+        assert_that(Example.parse('  (+) path(0, 1)\n')).is_equal_to(Example(lit('path', 0, 1), True))
+        for text in ('path(0, 1)', '(*) path(0, 1)', '(+) path(0, X)', '(-) path(0, 1) path(1, 2)'):
+            assert_that(Example.parse).raises(ValueError).when_called_with(text)
+
+    def test_learns_from_example_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'examples.txt')
+            with open(path, 'w') as stream:
+                stream.writelines('%r\n' % e for e in self.examples)
+
+            clauses = self.program.foil(self.target, self.examples, arrays=True)
+            assert_that(self.program.foil_file(self.target, path, chunk=10)).is_equal_to(clauses)
+            assert_that(self.program.foil_file).raises(ValueError).when_called_with(self.target, path, ratio=0)
+
+    def test_negative_sampling_keeps_positives_and_size(self):
+        lines = ['%r\n' % Example(lit('p', i), i % 10 == 0) for i in range(2000)]
+        training_set = ArrayTrainingSet.read(lines, lit('p', 'X'), World([]), ratio=0.25, chunk=300, seed=1)
+        assert_that(training_set.positives).is_equal_to(200)
+        assert_that(len(training_set.rows)).is_between(550, 800)
+        assert_that(training_set.size).is_close_to(2000, 200)
+
+    def test_array_training_sets_agree_with_lists(self):
+        ground = [*self.program.get_world(), *(e.fact for e in self.examples if e.positive)]
+        facts, world = Facts(ground), World(ground)
+        training_set = TrainingSet([e.get_assignment(self.target) for e in self.examples])
+        arrays = ArrayTrainingSet.encode(training_set, world)
+        for literal in (lit('edge', 'X', 'Y'), lit('edge', 'X', 'V0'), lit('edge', 'V0', 'X'),
+                        lit('path', 'Y', 'X'), lit('edge', 'Y', 'X', negated=True), lit('edge', 'X', 'X')):
+            assert_that(facts.get_counts(training_set, literal)).is_equal_to(world.get_counts(arrays, literal))
+            assert_that(facts.cover(training_set, literal)).is_equal_to(world.cover(arrays, literal))
+            _, extended = training_set.extend(literal, facts)
+            _, encoded = arrays.extend(literal, world)
+            assert_that(set(encoded)).is_equal_to(set(extended))